@@ -0,0 +1,257 @@
+"""
+Benchmark the pipeline stages on synthetic data
+Times and memory-profiles load_all_kaggle_data, merge_all_data,
+save_to_sqlite and generate_all_plots separately, writes the results to
+JSON and compares them against a stored baseline
+Usage: python benchmark.py [--scale 1 10 100] [--repeat N] [--skip-plots]
+                           [--baseline FILE] [--save-baseline] [--tolerance T]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+# Add src to path so we can import our modules
+sys.path.append(str(Path(__file__).parent / "src"))
+import importlib
+data_preprocessing = importlib.import_module('data preprocessing')
+import load_data
+import synthetic_data
+from load_data import load_all_kaggle_data
+from analysis import generate_all_plots
+
+merge_all_data = data_preprocessing.merge_all_data
+save_to_sqlite = data_preprocessing.save_to_sqlite
+
+BENCH_DIR = Path(__file__).parent / "benchmarks"
+RESULTS_FILE = BENCH_DIR / "results.json"
+BASELINE_FILE = BENCH_DIR / "baseline.json"
+TOLERANCE = 0.25  # a stage may be up to 25% slower than the baseline
+NOISE_FLOOR = 0.05  # seconds; smaller slowdowns are timer noise, not regressions
+START_YEAR = 2000
+STAGES = ["load", "merge", "save", "plots"]
+
+
+def measure(func, repeat=1):
+    """
+    Run func and return (result, seconds, peak_mb)
+    The time is the best of `repeat` untraced runs; the peak memory comes
+    from one extra run under tracemalloc (which slows things down too much
+    to time at the same time)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, min(times), peak / 1e6
+
+
+def run_benchmark(seasons, repeat=1, stages=STAGES, seed=0):
+    """
+    Benchmark the pipeline on `seasons` seasons of synthetic data
+    Runs in a temporary directory so data/, results/ and the database
+    don't touch the real ones
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+    years = list(range(START_YEAR, START_YEAR + seasons))
+    tables = synthetic_data.generate_tables(seasons=seasons, start_year=START_YEAR, seed=seed)
+    run = {
+        "seasons": seasons,
+        "input_rows": {name: len(df) for name, df in tables.items()},
+        "stages": {},
+    }
+
+    old_cwd = os.getcwd()
+    old_data_dir = load_data.DATA_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            load_data.DATA_DIR = synthetic_data.write_csvs(tables, Path(tmp) / "data")
+            del tables
+
+            # Later stages need the output of load/merge even if those
+            # stages aren't being reported
+            data, seconds, peak = measure(
+                lambda: load_all_kaggle_data(years=years, use_cache=False), repeat
+            )
+            if "load" in stages:
+                run["stages"]["load"] = stage_result(seconds, peak, sum(len(df) for df in data.values()))
+
+            df, seconds, peak = measure(lambda: merge_all_data(data, years=years), repeat)
+            if "merge" in stages:
+                run["stages"]["merge"] = stage_result(seconds, peak, len(df))
+
+            if "save" in stages:
+                _, seconds, peak = measure(lambda: save_to_sqlite(df, "bench.db"), repeat)
+                run["stages"]["save"] = stage_result(seconds, peak, len(df))
+
+            if "plots" in stages:
+                _, seconds, peak = measure(lambda: generate_all_plots(df, force=True), repeat)
+                run["stages"]["plots"] = stage_result(seconds, peak, len(df))
+        finally:
+            load_data.DATA_DIR = old_data_dir
+            os.chdir(old_cwd)
+    return run
+
+
+def stage_result(seconds, peak_mb, rows):
+    """One stage's numbers as they go into the JSON file"""
+    return {
+        "seconds": round(seconds, 4),
+        "peak_mb": round(peak_mb, 2),
+        "rows": int(rows),
+        "rows_per_second": round(rows / seconds) if seconds > 0 else None,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=TOLERANCE):
+    """
+    List the stages that got slower than the baseline allows
+    Runs are matched by number of seasons; stages missing from either side
+    are ignored, and so are slowdowns under NOISE_FLOOR seconds
+    Returns a list of (seasons, stage, baseline_s, now_s)
+    """
+    baseline_runs = {run["seasons"]: run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in results["runs"]:
+        old_run = baseline_runs.get(run["seasons"])
+        if old_run is None:
+            continue
+        for stage, numbers in run["stages"].items():
+            old = old_run["stages"].get(stage)
+            if old is None:
+                continue
+            limit = max(old["seconds"] * (1 + tolerance), old["seconds"] + NOISE_FLOOR)
+            if numbers["seconds"] > limit:
+                regressions.append((run["seasons"], stage, old["seconds"], numbers["seconds"]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """Table of the timings, with the change against the baseline if given"""
+    baseline_runs = {run["seasons"]: run for run in (baseline or {}).get("runs", [])}
+    print(f"\n{'seasons':>8} {'stage':<6} {'seconds':>9} {'peak MB':>9} {'rows/s':>11} {'vs base':>8}")
+    for run in results["runs"]:
+        old_run = baseline_runs.get(run["seasons"], {"stages": {}})
+        for stage, numbers in run["stages"].items():
+            old = old_run["stages"].get(stage)
+            change = ""
+            if old and old["seconds"] > 0:
+                change = f"{numbers['seconds'] / old['seconds'] - 1:+.0%}"
+            rate = numbers["rows_per_second"] or 0
+            print(f"{run['seasons']:>8} {stage:<6} {numbers['seconds']:>9.3f} "
+                  f"{numbers['peak_mb']:>9.1f} {rate:>11,} {change:>8}")
+
+
+def parse_args(argv=None):
+    """Command line options for the benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark the F1 pipeline stages")
+    parser.add_argument(
+        "--scale",
+        type=int,
+        nargs="+",
+        default=[1, 10],
+        help="number of synthetic seasons to benchmark (1 to 100, default 1 10)"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="timed runs per stage; the best one is reported"
+    )
+    parser.add_argument(
+        "--skip-plots",
+        action="store_true",
+        help="don't benchmark generate_all_plots"
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=RESULTS_FILE,
+        help="where to write the results (default benchmarks/results.json)"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=BASELINE_FILE,
+        help="baseline results to compare against"
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the new baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="allowed slowdown against the baseline (0.25 = 25%%)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmarks, save them, and exit with 1 on a regression"""
+    args = parse_args(argv)
+    stages = [s for s in STAGES if not (args.skip_plots and s == "plots")]
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "runs": [],
+    }
+    for seasons in args.scale:
+        print(f"\nBenchmarking {seasons} season(s)...")
+        results["runs"].append(run_benchmark(seasons, args.repeat, stages))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"\n✓ Results saved to {args.output}")
+
+    baseline = None
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"\n✓ Baseline saved to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline} (run with --save-baseline to create one)")
+        return 0
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n✗ {len(regressions)} stage(s) slower than the baseline:")
+        for seasons, stage, old, new in regressions:
+            print(f"  - {stage} at {seasons} season(s): {old:.3f}s -> {new:.3f}s")
+        return 1
+    print("\n✓ No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
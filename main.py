@@ -1,76 +1,336 @@
 """
 Main script to run the complete Formula 1 analysis pipeline
-Usage: python main.py
+Usage: python main.py [--refresh-cache] [--incremental] [--parallel-plots] [--force-plots]
+                      [--stream-laps] [--workers N] [--report FILE] [--trace-memory] [--profile]
+                      [--publish] [--dpi N] [--plot-format FMT]
+                      [--years 2022-2024] [--batch 2014-2016 2017-2021 ...]
+                      [--only STEP ...] [--skip STEP ...] [--force] [--sequential]
 """
 
+import argparse
+import cProfile
 import sys
+from functools import partial
 from pathlib import Path
 
 # Add src to path so we can import our modules
 sys.path.append(str(Path(__file__).parent / "src"))
 import importlib
 data_preprocessing = importlib.import_module('data preprocessing')
-from load_data import load_all_kaggle_data, fetch_openf1_drivers
-from analysis import generate_all_plots
+from load_data import load_all_kaggle_data, fetch_openf1_drivers, has_pyarrow, DATA_DIR, KAGGLE_FILES
+from analysis import generate_all_plots, plot_columns, plot_files
+from database import DB_FILE
+from pipeline import Pipeline, Stage
+from shared_dataset import SHARED_FILE, load_shared, publish
+from analysis import season_label
+from batch import parse_years, run_batch
+import instrumentation
 
 merge_all_data = data_preprocessing.merge_all_data
 save_to_sqlite = data_preprocessing.save_to_sqlite
+update_race_metrics = data_preprocessing.update_race_metrics
+YEARS = data_preprocessing.YEARS
 
+REPORT_FILE = Path("results") / "run_report.json"
+PROFILE_FILE = Path("results") / "profile.prof"
+STEPS = ["load", "api", "merge", "save", "update", "publish", "plots"]
 
-def main():
+
+def parse_args(argv=None):
+    """Command line options for the pipeline"""
+    parser = argparse.ArgumentParser(description="F1 pit stop and lap time analysis")
+    parser.add_argument(
+        "--years",
+        default=None,
+        help="seasons to analyse, e.g. 2018-2024 or 2019,2021 (default 2022-2024)"
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="RANGE",
+        help="build one report per year range (e.g. 2014-2016 2017-2021) into "
+             "results/<range>/, loading and aggregating the data only once"
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        metavar="STEP",
+        choices=STEPS,
+        help=f"only run these steps and what they need ({', '.join(STEPS)})"
+    )
+    parser.add_argument(
+        "--skip",
+        nargs="+",
+        metavar="STEP",
+        choices=STEPS,
+        help="don't run these steps (or the steps that need them)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run every step, even the ones whose outputs are up to date"
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="run one step at a time instead of independent steps together"
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="re-parse the CSVs and rebuild data/.cache"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only recompute races whose input data changed since the last run"
+    )
+    parser.add_argument(
+        "--parallel-plots",
+        action="store_true",
+        help="render each plot in its own worker process"
+    )
+    parser.add_argument(
+        "--force-plots",
+        action="store_true",
+        help="re-render every plot even if its inputs haven't changed"
+    )
+    parser.add_argument(
+        "--stream-laps",
+        action="store_true",
+        help="read lap_times.csv in chunks instead of loading it into memory "
+             "(not used with --incremental, which needs the lap rows for fingerprints)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes for the pit/lap aggregation (0 = all cores, default 1)"
+    )
+    parser.add_argument(
+        "--parallel-load",
+        action="store_true",
+        help="read the CSV files at the same time (threads with pyarrow, "
+             "processes without it)"
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=None,
+        help="resolution of the saved plots (default 300; e.g. 100 for a quick preview)"
+    )
+    parser.add_argument(
+        "--plot-format",
+        choices=["png", "jpg", "svg", "pdf"],
+        default=None,
+        help="file format of the saved plots (default png)"
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help=f"also write the merged data to {SHARED_FILE} for other processes to "
+             "memory-map (needs pyarrow; used by --parallel-plots)"
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=REPORT_FILE,
+        help=f"where to write the JSON timing/memory report (default {REPORT_FILE})"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also record Python-level peak memory per stage with tracemalloc (slower)"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"run under cProfile and dump the stats to {PROFILE_FILE}"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Run the pipeline and write the run report (and profile, if asked for)
+    The report is written even when a step fails, so it shows where
+    """
+    args = parse_args(argv)
+    instrumentation.reset()
+    if args.trace_memory:
+        instrumentation.start_memory_tracing()
+    
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        run_pipeline(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            PROFILE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(PROFILE_FILE)
+            print(f"✓ Profile saved to {PROFILE_FILE} (view with: python -m pstats {PROFILE_FILE})")
+        instrumentation.print_summary()
+        report = instrumentation.write_report(args.report, argv=sys.argv[1:] if argv is None else argv)
+        print(f"✓ Run report saved to {report}")
+
+
+def load_stage(years, refresh_cache, tables, concurrent):
+    """Load the CSVs, failing if any of them is missing"""
+    data = load_all_kaggle_data(
+        years=years, refresh_cache=refresh_cache, tables=tables, concurrent=concurrent
+    )
+    failed = [key for key, df in data.items() if df is None]
+    if failed:
+        raise FileNotFoundError(
+            f"failed to load {', '.join(failed)} (make sure all CSV files are in the data/ folder)"
+        )
+    return data
+
+
+def api_stage():
+    """Optional: get additional driver info from the OpenF1 API"""
+    api_drivers = fetch_openf1_drivers(year=2023)
+    if api_drivers is not None:
+        print(f"✓ Retrieved info for {len(api_drivers)} drivers")
+    return api_drivers
+
+
+def merge_stage(data, years, workers, lap_times_path):
+    """Clean and merge the tables into one row per driver per race"""
+    if lap_times_path is not None:
+        return merge_all_data(data, years=years, lap_times_path=lap_times_path)
+    return merge_all_data(data, years=years, workers=workers)
+
+
+def update_stage(data, years):
+    """--incremental: recompute changed races and write them into the database"""
+    return update_race_metrics(data, years)
+
+
+def publish_stage(df_clean, path):
+    """--publish: write the merged data as a shared Arrow file, returning its path"""
+    return publish(df_clean, path)
+
+
+def plots_stage(df_clean, parallel, force, dpi, fmt, shared_path=None):
+    """Generate the visualizations and summary statistics"""
+    import matplotlib
+    matplotlib.use("Agg")
+    return generate_all_plots(
+        df_clean, parallel=parallel, force=force, shared_path=shared_path, dpi=dpi, fmt=fmt
+    )
+
+
+def shared_plots_stage(shared_path, parallel, force, dpi, fmt):
+    """plots_stage on the columns it needs, mapped from the published file"""
+    df_clean = load_shared(shared_path, plot_columns())
+    return plots_stage(df_clean, parallel, force, dpi, fmt, shared_path=shared_path)
+
+
+def build_pipeline(args, years, publish_path):
+    """
+    The pipeline as a dependency graph:
+      load -> merge -> save           api (on its own)
+                    -> plots
+    (with --incremental, update instead of merge and save; with --publish,
+    merge/update -> publish -> plots). save/update, publish and plots are
+    skipped when the CSVs, years and settings are the same as last time
+    """
+    workers = args.workers or None
+    stream_laps = args.stream_laps and not args.incremental
+    tables = [key for key in KAGGLE_FILES if key != "lap_times"] if stream_laps else None
+    lap_times_path = DATA_DIR / KAGGLE_FILES["lap_times"] if stream_laps else None
+    csv_files = [DATA_DIR / filename for filename in KAGGLE_FILES.values()]
+    # Streamed lap times have no median, so they change what gets written
+    data_params = {"years": years, "stream_laps": stream_laps}
+    settings = {**data_params, "dpi": args.dpi, "fmt": args.plot_format}
+
+    stages = [
+        Stage("load", partial(load_stage, years, args.refresh_cache, tables,
+                              args.parallel_load or None)),
+        Stage("api", api_stage),
+    ]
+    if args.incremental:
+        stages.append(Stage("update", partial(update_stage, years=years),
+                            inputs=["load"], outputs=[DB_FILE], sources=csv_files,
+                            params=data_params))
+        data_stage = "update"
+    else:
+        stages.append(Stage("merge", partial(merge_stage, years=years, workers=workers,
+                                             lap_times_path=lap_times_path),
+                            inputs=["load"]))
+        stages.append(Stage("save", save_to_sqlite, inputs=["merge"], outputs=[DB_FILE],
+                            sources=csv_files, params=data_params))
+        data_stage = "merge"
+    plot_options = {"parallel": args.parallel_plots, "force": args.force_plots or args.force,
+                    "dpi": args.dpi, "fmt": args.plot_format}
+    if publish_path:
+        stages.append(Stage("publish", partial(publish_stage, path=publish_path),
+                            inputs=[data_stage], outputs=[publish_path], sources=csv_files,
+                            params=data_params))
+        # Only the file's path goes to the plots process, which maps the
+        # columns it needs, so it runs there without the GIL and without
+        # a pickled copy of the data while the database is being written
+        stages.append(Stage("plots", partial(shared_plots_stage, **plot_options),
+                            inputs=["publish"], outputs=plot_files(args.plot_format),
+                            sources=csv_files, params=settings, pool="process"))
+    else:
+        stages.append(Stage("plots", partial(plots_stage, **plot_options),
+                            inputs=[data_stage], outputs=plot_files(args.plot_format),
+                            sources=csv_files, params=settings))
+    return Pipeline(stages)
+
+
+def run_pipeline(args):
     """
     Run the full F1 analysis pipeline:
     1. Load data from CSVs and API
     2. Clean and merge data
     3. Save to SQLite database
     4. Generate visualizations and statistics
+    Independent steps run at the same time (unless --sequential) and
+    steps whose outputs are up to date are skipped (unless --force)
     """
-    print("\n" + "="*60)
-    print("F1 Pit Stop and Lap Time Analysis (2022-2024)")
-    print("="*60)
-    
-    # Step 1: Load data
-    print("\n[Step 1/4] Loading data from CSV files...")
-    data = load_all_kaggle_data()
-    
-    # Check if data loaded successfully
-    if any(df is None for df in data.values()):
-        print("\n✗ Error: Failed to load some data files")
-        print("Make sure all CSV files are in the data/ folder")
+    if args.batch:
+        run_batch_mode(args, args.workers or None)
+        return
+    try:
+        years = parse_years(args.years) if args.years else YEARS
+    except ValueError as e:
+        print(f"\n✗ Error: bad --years range: {e}")
         sys.exit(1)
+    publish_path = None
+    if args.publish:
+        if has_pyarrow():
+            publish_path = SHARED_FILE
+        else:
+            print("✗ --publish needs pyarrow, the shared dataset won't be written")
     
-    # Optional: get additional driver info from API
-    print("\n[Step 1b] Fetching driver info from OpenF1 API...")
-    api_drivers = fetch_openf1_drivers(year=2023)
-    if api_drivers is not None:
-        print(f"✓ Retrieved info for {len(api_drivers)} drivers")
+    print("\n" + "="*60)
+    print(f"F1 Pit Stop and Lap Time Analysis ({season_label(years)})")
+    print("="*60 + "\n")
     
-    # Step 2: Clean and merge data
-    print("\n[Step 2/4] Preprocessing and merging data...")
+    pipeline = build_pipeline(args, years, publish_path)
+    force = True if args.force else (["plots"] if args.force_plots else False)
+    # cProfile only sees the main thread, so profile runs go one step at a time
+    concurrent = not (args.sequential or args.profile)
     try:
-        df_clean = merge_all_data(data)
-    except Exception as e:
-        print(f"\n✗ Error during preprocessing: {e}")
+        results, failures = pipeline.run(args.only, args.skip or (), force, concurrent)
+    except ValueError as e:
+        print(f"\n✗ Error: {e}")
         sys.exit(1)
     
-    # Step 3: Save to database
-    print("\n[Step 3/4] Saving data to SQLite database...")
-    try:
-        save_to_sqlite(df_clean)
-    except Exception as e:
-        print(f"\n✗ Error saving to database: {e}")
-    
-    # Step 4: Generate visualizations
-    print("\n[Step 4/4] Creating visualizations...")
-    try:
-        stats = generate_all_plots(df_clean)
-    except Exception as e:
-        print(f"\n✗ Error generating plots: {e}")
+    if failures:
+        print(f"\n✗ {len(failures)} step(s) failed:")
+        for name, error in failures.items():
+            print(f"  - {name}: {error}")
         sys.exit(1)
     
     # Done!
     print("\n" + "="*60)
-    print("✓ Analysis complete!")
+    print(f"✓ Analysis complete! ({', '.join(results) or 'everything was up to date'})")
     print("="*60)
     print("\nOutput files:")
     print("  - results/ folder contains all visualizations")
@@ -79,6 +339,33 @@ def main():
     print("="*60 + "\n")
 
 
+def run_batch_mode(args, workers):
+    """--batch: one set of plots and stats per year range from a single load"""
+    try:
+        year_ranges = [parse_years(text) for text in args.batch]
+    except ValueError as e:
+        print(f"\n✗ Error: bad --batch range: {e}")
+        sys.exit(1)
+    
+    print("\n" + "="*60)
+    print(f"F1 Pit Stop and Lap Time Analysis - batch of {len(year_ranges)} reports")
+    print("="*60)
+    try:
+        run_batch(
+            year_ranges, refresh_cache=args.refresh_cache, workers=workers,
+            concurrent_load=args.parallel_load or None,
+            parallel=args.parallel_plots, force=args.force_plots,
+            dpi=args.dpi, fmt=args.plot_format
+        )
+    except Exception as e:
+        print(f"\n✗ Error during batch run: {e}")
+        sys.exit(1)
+    
+    print("\n" + "="*60)
+    print("✓ Batch complete! Each range has its own folder in results/")
+    print("="*60 + "\n")
+
+
 if __name__ == "__main__":
     try:
         main()
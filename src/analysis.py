@@ -2,109 +2,271 @@
 Analysis and visualization part for Formula 1 race Project
 """
 
+import functools
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import as_completed
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from pathlib import Path
 
+import instrumentation
+from bootstrap import BOOTSTRAP_SAMPLES, SEED, driver_lap_variance_ci, error_bars, team_pit_ci
+from instrumentation import instrumented
+from workers import can_spawn, process_pool
+
+# matplotlib and seaborn are imported inside the plot functions: they take
+# about half a second to import and most callers (data loading, database
+# queries, worker processes) never draw anything
 RESULTS_DIR = Path("results")
-RESULTS_DIR.mkdir(exist_ok=True)
+
+# Fingerprints of the rendered plots, one small JSON file per plot
+MANIFEST_DIR_NAME = ".plot_manifest"
+
+# Output settings, changed with configure_output() (e.g. 100 dpi for a
+# quick preview, or "svg"/"pdf" for vector output). SEASON_LABEL goes in
+# the plot titles; generate_all_plots sets it from the years in the data
+PLOT_DPI = 300
+PLOT_FORMAT = "png"
+SEASON_LABEL = "2022-2024"
+
+# Above this many points scatter plots switch to a binned density plot, so
+# the number of artists (and the render time) stays the same as data grows
+DENSITY_THRESHOLD = 5000
+
+
+def configure_output(dpi=None, fmt=None, label=None):
+    """Set the dpi, file format and/or season label used by every plot"""
+    global PLOT_DPI, PLOT_FORMAT, SEASON_LABEL
+    if dpi is not None:
+        PLOT_DPI = int(dpi)
+    if fmt is not None:
+        PLOT_FORMAT = fmt.lstrip(".").lower()
+    if label is not None:
+        SEASON_LABEL = str(label)
+
+
+def output_options():
+    """Current output settings, to hand to worker processes"""
+    return {"dpi": PLOT_DPI, "fmt": PLOT_FORMAT, "label": SEASON_LABEL}
+
+
+def season_label(years):
+    """[2022, 2023, 2024] -> "2022-2024", [2023] -> "2023", [2019, 2021] -> "2019, 2021" """
+    years = sorted(set(int(y) for y in years))
+    if not years:
+        return ""
+    if len(years) == 1:
+        return str(years[0])
+    if years == list(range(years[0], years[-1] + 1)):
+        return f"{years[0]}-{years[-1]}"
+    return ", ".join(str(y) for y in years)
+
+
+def plot_path(name):
+    """Output file for a plot, e.g. grid_vs_finish -> results/grid_vs_finish.png"""
+    return RESULTS_DIR / f"{name}.{PLOT_FORMAT}"
 
 
-def plot_grid_vs_finish(df):
+def save_plot(name):
+    """Save the current figure with the configured dpi/format and close it"""
+    import matplotlib.pyplot as plt
+    
+    output_path = plot_path(name)
+    plt.savefig(output_path, dpi=PLOT_DPI, bbox_inches="tight")
+    print(f"✓ Saved: {output_path}")
+    plt.close()
+
+
+def normalized_values(data):
+    """
+    data with numbers as float64 and everything else as strings, so the
+    same values hash the same whatever dtype they were loaded with (e.g.
+    int16 from the CSVs vs int64 or float from SQLite)
+    """
+    return pd.DataFrame({
+        col: values.astype("float64") if pd.api.types.is_numeric_dtype(values) else values.astype("string")
+        for col, values in data.items()
+    })
+
+
+def plot_fingerprint(func, df, params):
+    """
+    Hash everything a plot depends on: the columns it reads, its parameters
+    and its own source code (so editing a plot re-renders it)
+    """
+    h = hashlib.sha256()
+    columns = PLOTS.get(func.__name__, list(df.columns))
+    data = normalized_values(df[columns])
+    h.update(json.dumps(list(data.columns)).encode())
+    h.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    h.update(json.dumps([PLOT_DPI, PLOT_FORMAT, SEASON_LABEL]).encode())
+    h.update(inspect.getsource(func).encode())
+    return h.hexdigest()
+
+
+def cached_plot(func):
+    """
+    Decorator for the plot_* functions: skip rendering when the PNG exists
+    and the fingerprint of its inputs matches the one saved last time
+    Pass force=True to render anyway
+    """
+    signature = inspect.signature(func)
+    
+    @functools.wraps(func)
+    def wrapper(df, *args, force=False, **kwargs):
+        bound = signature.bind(df, *args, **kwargs)
+        bound.apply_defaults()
+        params = dict(list(bound.arguments.items())[1:])
+        
+        # Plot files are named after the function, e.g. plot_x -> x.png
+        output_path = plot_path(func.__name__[len('plot_'):])
+        manifest_path = RESULTS_DIR / MANIFEST_DIR_NAME / f"{func.__name__}.json"
+        fingerprint = plot_fingerprint(func, df, params)
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        
+        if not force and output_path.exists() and manifest_path.exists():
+            saved = json.loads(manifest_path.read_text())
+            if saved.get("fingerprint") == fingerprint:
+                print(f"✓ Up to date: {output_path}")
+                return None
+        
+        result = func(df, *args, **kwargs)
+        
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps({"fingerprint": fingerprint, "params": params}, default=str))
+        return result
+    
+    return wrapper
+
+
+def team_pit_times(df):
+    """Average pit stop time per team, fastest first (teams without stops dropped)"""
+    return df.groupby("team_name")["avg_pit_ms"].mean().sort_values().dropna()
+
+
+def driver_lap_variance(df, min_races=10, top_n=None):
+    """
+    Average lap time variance per driver with at least min_races results,
+    most consistent first (optionally only the top_n)
+    """
+    driver_race_counts = df.groupby("driver_name").size()
+    valid_drivers = driver_race_counts[driver_race_counts >= min_races].index
+    df_filtered = df[df["driver_name"].isin(valid_drivers)]
+    
+    lap_var = df_filtered.groupby("driver_name")["lap_var_ms"].mean().sort_values().dropna()
+    if top_n is not None:
+        lap_var = lap_var.head(top_n)
+    return lap_var
+
+
+@instrumented(rows_arg="df")
+@cached_plot
+def plot_grid_vs_finish(df, max_points=DENSITY_THRESHOLD):
     """
     Scatter plot: starting grid position vs finishing position
+    With more than max_points results it draws a 2-D histogram instead
+    (one mesh instead of one marker per result)
     """
+    import matplotlib.pyplot as plt
+    
     # Only look at drivers who finished (positionOrder > 0)
-    df_finished = df[df["positionOrder"] > 0].copy()
+    df_finished = df[df["positionOrder"] > 0]
+    grid = df_finished["grid"].to_numpy()
+    finish = df_finished["positionOrder"].to_numpy()
     
     plt.figure(figsize=(10, 8))
-    plt.scatter(
-        df_finished["grid"], 
-        df_finished["positionOrder"],
-        alpha=0.4,
-        s=50,
-        color='steelblue'
-    )
+    if len(df_finished) > max_points:
+        # Positions are whole numbers, so use one bin per position
+        edges = np.arange(min(grid.min(), finish.min()), max(grid.max(), finish.max()) + 2) - 0.5
+        counts, x_edges, y_edges = np.histogram2d(grid, finish, bins=[edges, edges])
+        counts = np.ma.masked_equal(counts, 0)
+        mesh = plt.pcolormesh(x_edges, y_edges, counts.T, cmap="Blues", rasterized=True)
+        plt.colorbar(mesh, label="Results")
+    else:
+        plt.scatter(
+            grid,
+            finish,
+            alpha=0.4,
+            s=50,
+            color='steelblue'
+        )
     
     # Add diagonal reference line (perfect correlation)
-    max_pos = max(df_finished["grid"].max(), df_finished["positionOrder"].max())
+    max_pos = max(grid.max(), finish.max())
     plt.plot([0, max_pos], [0, max_pos], 'r--', alpha=0.5, label="Perfect correlation")
     
     plt.xlabel("Starting Grid Position", fontsize=12)
     plt.ylabel("Finishing Position", fontsize=12)
-    plt.title("Qualifying vs Finishing Position (2022-2024)", fontsize=14, fontweight='bold')
+    plt.title(f"Qualifying vs Finishing Position ({SEASON_LABEL})", fontsize=14, fontweight='bold')
     plt.legend()
     plt.grid(True, alpha=0.3)
     plt.tight_layout()
     
-    output_path = RESULTS_DIR / "grid_vs_finish.png"
-    plt.savefig(output_path, dpi=300, bbox_inches="tight")
-    print(f"✓ Saved: {output_path}")
-    plt.close()
+    save_plot("grid_vs_finish")
 
 
-def plot_pit_stops_by_team(df):
+@instrumented(rows_arg="df")
+@cached_plot
+def plot_pit_stops_by_team(df, n_samples=BOOTSTRAP_SAMPLES, seed=SEED):
     """
-    Bar chart of average pit stop times by team
+    Bar chart of average pit stop times by team, with 95% bootstrap CIs
     Lower is better (faster pit crew)
     """
-    # Calculate average pit time per team
-    team_pit = df.groupby("team_name")["avg_pit_ms"].mean().sort_values()
+    import matplotlib.pyplot as plt
     
-    # Remove NaN values
-    team_pit = team_pit.dropna()
+    # Average pit time per team (teams without pit data are dropped)
+    team_pit, _ = team_pit_ci(df, n_samples=n_samples, seed=seed)
     
     plt.figure(figsize=(12, 6))
-    team_pit.plot(kind="bar", color="slateblue")
-    plt.title("Average Pit Stop Duration by Team (2022-2024)", fontsize=14, fontweight='bold')
+    team_pit["mean"].plot(kind="bar", color="slateblue", yerr=error_bars(team_pit), capsize=4)
+    plt.title(f"Average Pit Stop Duration by Team ({SEASON_LABEL})", fontsize=14, fontweight='bold')
     plt.xlabel("Team", fontsize=12)
-    plt.ylabel("Avg Pit Stop Time (ms)", fontsize=12)
+    plt.ylabel("Avg Pit Stop Time (ms, 95% CI)", fontsize=12)
     plt.xticks(rotation=45, ha="right")
     plt.grid(axis='y', alpha=0.3)
     plt.tight_layout()
     
-    output_path = RESULTS_DIR / "pit_stops_by_team.png"
-    plt.savefig(output_path, dpi=300, bbox_inches="tight")
-    print(f"✓ Saved: {output_path}")
-    plt.close()
+    save_plot("pit_stops_by_team")
 
 
-def plot_lap_variance_by_driver(df, min_races=10, top_n=20):
+@instrumented(rows_arg="df")
+@cached_plot
+def plot_lap_variance_by_driver(df, min_races=10, top_n=20, n_samples=BOOTSTRAP_SAMPLES, seed=SEED):
     """
-    Bar chart showing lap time consistency for drivers
+    Bar chart showing lap time consistency for drivers, with 95% bootstrap CIs
     Lower variance = more consistent driver
     """
-    # Filter drivers with enough data
-    driver_race_counts = df.groupby("driver_name").size()
-    valid_drivers = driver_race_counts[driver_race_counts >= min_races].index
+    import matplotlib.pyplot as plt
     
-    df_filtered = df[df["driver_name"].isin(valid_drivers)]
-    
-    # Calculate average lap variance per driver
-    lap_var = df_filtered.groupby("driver_name")["lap_var_ms"].mean().sort_values()
-    lap_var = lap_var.dropna().head(top_n)
+    # Average lap variance per driver, for drivers with enough races
+    lap_var, _ = driver_lap_variance_ci(df, min_races, top_n, n_samples=n_samples, seed=seed)
     
     plt.figure(figsize=(12, 8))
-    lap_var.plot(kind="barh", color="orange")
+    lap_var["mean"].plot(kind="barh", color="orange", xerr=error_bars(lap_var), capsize=3)
     plt.title(f"Lap Time Variance by Driver (Top {top_n}, Lower = More Consistent)", 
               fontsize=14, fontweight='bold')
-    plt.xlabel("Lap Time Variance (ms²)", fontsize=12)
+    plt.xlabel("Lap Time Variance (ms², 95% CI)", fontsize=12)
     plt.ylabel("Driver", fontsize=12)
     plt.grid(axis='x', alpha=0.3)
     plt.tight_layout()
     
-    output_path = RESULTS_DIR / "lap_variance_by_driver.png"
-    plt.savefig(output_path, dpi=300, bbox_inches="tight")
-    print(f"✓ Saved: {output_path}")
-    plt.close()
+    save_plot("lap_variance_by_driver")
 
 
+@instrumented(rows_arg="df")
+@cached_plot
 def plot_correlation_heatmap(df):
     """
     Correlation heatmap of performance metrics
     Shows relationships between different race factors
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    
     # Select numeric columns for correlation
     metric_cols = ["grid", "positionOrder", "positions_gained", "avg_pit_ms", "lap_var_ms"]
     
@@ -132,7 +294,7 @@ def plot_correlation_heatmap(df):
         linewidths=1,
         cbar_kws={"shrink": 0.8}
     )
-    plt.title("Correlation Between Performance Metrics (2022-2024)", 
+    plt.title(f"Correlation Between Performance Metrics ({SEASON_LABEL})", 
               fontsize=14, fontweight='bold', pad=20)
     
     # Rotate labels to be horizontal
@@ -141,41 +303,40 @@ def plot_correlation_heatmap(df):
     
     plt.tight_layout()
     
-    output_path = RESULTS_DIR / "correlation_heatmap.png"
-    plt.savefig(output_path, dpi=300, bbox_inches="tight")
-    print(f"✓ Saved: {output_path}")
-    plt.close()
+    save_plot("correlation_heatmap")
 
 
+@instrumented(rows_arg="df")
+@cached_plot
 def plot_positions_gained_distribution(df):
     """
     Histogram showing distribution of positions gained/lost
     Positive = gained positions, Negative = lost positions
     """
-    df_finished = df[df["positionOrder"] > 0].copy()
+    import matplotlib.pyplot as plt
+    
+    df_finished = df[df["positionOrder"] > 0]
+    
+    # Bin with NumPy and draw the counts as bars (30 bars however many rows)
+    counts, edges = np.histogram(df_finished["positions_gained"].to_numpy(), bins=30)
     
     plt.figure(figsize=(10, 6))
-    plt.hist(df_finished["positions_gained"], bins=30, color="teal", alpha=0.7, edgecolor='black')
+    plt.bar(edges[:-1], counts, width=np.diff(edges), align="edge",
+            color="teal", alpha=0.7, edgecolor='black')
     plt.axvline(x=0, color='red', linestyle='--', linewidth=2, label='No change')
     plt.xlabel("Positions Gained/Lost", fontsize=12)
     plt.ylabel("Frequency", fontsize=12)
-    plt.title("Distribution of Position Changes During Race (2022-2024)", 
+    plt.title(f"Distribution of Position Changes During Race ({SEASON_LABEL})", 
               fontsize=14, fontweight='bold')
     plt.legend()
     plt.grid(axis='y', alpha=0.3)
     plt.tight_layout()
     
-    output_path = RESULTS_DIR / "positions_gained_distribution.png"
-    plt.savefig(output_path, dpi=300, bbox_inches="tight")
-    print(f"✓ Saved: {output_path}")
-    plt.close()
+    save_plot("positions_gained_distribution")
 
 
-def generate_summary_stats(df):
-    """
-    Generate and print summary statistics
-    Returns a dict with key metrics
-    """
+def compute_summary_stats(df, min_races=10):
+    """Key metrics as a dict (without printing them)"""
     stats = {}
     
     # Basic counts
@@ -186,24 +347,36 @@ def generate_summary_stats(df):
     # Average pit stop time
     stats["avg_pit_time"] = df["avg_pit_ms"].mean()
     
-    # Team with fastest average pit stops
-    team_pit = df.groupby("team_name")["avg_pit_ms"].mean().sort_values()
+    # Team with fastest average pit stops, with a 95% CI and how often it
+    # came out fastest when the stops are resampled
+    team_pit, _ = team_pit_ci(df)
     if len(team_pit) > 0:
         stats["fastest_pit_team"] = team_pit.index[0]
-        stats["fastest_pit_time"] = team_pit.iloc[0]
+        stats["fastest_pit_time"] = team_pit["mean"].iloc[0]
+        stats["fastest_pit_ci"] = [team_pit["ci_low"].iloc[0], team_pit["ci_high"].iloc[0]]
+        stats["fastest_pit_p_best"] = team_pit["p_best"].iloc[0]
     
     # Most consistent driver (lowest lap variance)
-    driver_counts = df.groupby("driver_name").size()
-    valid_drivers = driver_counts[driver_counts >= 10].index
-    df_valid = df[df["driver_name"].isin(valid_drivers)]
-    
-    driver_var = df_valid.groupby("driver_name")["lap_var_ms"].mean().sort_values()
+    driver_var, _ = driver_lap_variance_ci(df, min_races)
     if len(driver_var) > 0:
         stats["most_consistent_driver"] = driver_var.index[0]
-        stats["lowest_variance"] = driver_var.iloc[0]
+        stats["lowest_variance"] = driver_var["mean"].iloc[0]
+        stats["lowest_variance_ci"] = [driver_var["ci_low"].iloc[0], driver_var["ci_high"].iloc[0]]
+        stats["most_consistent_p_best"] = driver_var["p_best"].iloc[0]
+    
+    return stats
+
+
+@instrumented()
+def generate_summary_stats(df):
+    """
+    Generate and print summary statistics
+    Returns a dict with key metrics
+    """
+    stats = compute_summary_stats(df)
     
     print("\n" + "="*50)
-    print("SUMMARY STATISTICS (2022-2024)")
+    print(f"SUMMARY STATISTICS ({SEASON_LABEL})")
     print("="*50)
     print(f"Total Races Analyzed: {stats['total_races']}")
     print(f"Total Drivers: {stats['total_drivers']}")
@@ -211,37 +384,159 @@ def generate_summary_stats(df):
     print(f"\nAverage Pit Stop Time: {stats['avg_pit_time']:.0f} ms")
     
     if "fastest_pit_team" in stats:
-        print(f"Fastest Pit Team: {stats['fastest_pit_team']} ({stats['fastest_pit_time']:.0f} ms)")
+        low, high = stats["fastest_pit_ci"]
+        print(f"Fastest Pit Team: {stats['fastest_pit_team']} ({stats['fastest_pit_time']:.0f} ms, "
+              f"95% CI {low:.0f}-{high:.0f}, fastest in {stats['fastest_pit_p_best']:.0%} of resamples)")
     
     if "most_consistent_driver" in stats:
-        print(f"Most Consistent Driver: {stats['most_consistent_driver']}")
+        print(f"Most Consistent Driver: {stats['most_consistent_driver']} "
+              f"(most consistent in {stats['most_consistent_p_best']:.0%} of resamples)")
     
     print("="*50 + "\n")
     
     return stats
 
 
-def generate_all_plots(df):
+# Each plot and the columns it reads (workers only get these columns)
+PLOTS = {
+    "plot_grid_vs_finish": ["grid", "positionOrder"],
+    "plot_pit_stops_by_team": ["team_name", "avg_pit_ms"],
+    "plot_lap_variance_by_driver": ["driver_name", "lap_var_ms"],
+    "plot_correlation_heatmap": ["grid", "positionOrder", "positions_gained", "avg_pit_ms", "lap_var_ms"],
+    "plot_positions_gained_distribution": ["positionOrder", "positions_gained"],
+}
+
+# Columns the summary stats and the season label in the titles read
+SUMMARY_COLUMNS = ["year", "raceId", "driverId", "team_name", "avg_pit_ms", "driver_name", "lap_var_ms"]
+
+
+def plot_columns():
+    """Every column generate_all_plots reads (to load only those from a shared file)"""
+    columns = list(SUMMARY_COLUMNS)
+    for needed in PLOTS.values():
+        columns += [col for col in needed if col not in columns]
+    return columns
+
+
+def plot_files(fmt=None):
+    """Files generate_all_plots writes to RESULTS_DIR (in fmt, default PLOT_FORMAT)"""
+    fmt = (fmt or PLOT_FORMAT).lstrip(".").lower()
+    return [RESULTS_DIR / f"{name[len('plot_'):]}.{fmt}" for name in PLOTS]
+
+
+def render_plot(name, df, results_dir=None, force=False, shared_path=None, options=None):
+    """
+    Run one plot function by name (used by the worker processes)
+    With df=None the plot's columns are memory-mapped from shared_path
+    options are the parent's output settings (see output_options)
+    Always uses the Agg backend since workers have no display
+    Returns the instrumentation records for the plot so the parent process
+    can put them in its run report
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    
+    global RESULTS_DIR
+    if results_dir is not None:
+        RESULTS_DIR = Path(results_dir)
+    configure_output(**(options or {}))
+    # Workers are reused, so drop the records from their previous plot
+    instrumentation.reset()
+    if df is None:
+        from shared_dataset import load_shared
+        df = load_shared(shared_path, PLOTS[name])
+    globals()[name](df, force=force)
+    return instrumentation.get_records()
+
+
+def render_plots_parallel(df, workers=None, force=False, shared_path=None):
+    """
+    Render every plot in PLOTS in its own worker process
+    Each worker gets only the columns its plot needs, so the full frame is
+    never pickled. With shared_path (a file from shared_dataset.publish)
+    the workers map the columns from that file and nothing is pickled
+    A failing plot is reported without stopping the others
+    The workers are spawned (see workers.py), so a script calling this
+    needs an `if __name__ == "__main__":` guard
+    Returns a dict of plot name -> error message for the plots that failed
+    """
+    if workers is None:
+        workers = min(len(PLOTS), os.cpu_count() or 1)
+    
+    failures = {}
+    with process_pool(workers) as pool:
+        futures = {}
+        for name, columns in PLOTS.items():
+            missing = [col for col in columns if col not in df.columns]
+            if missing:
+                failures[name] = f"missing columns {missing}"
+                print(f"✗ {name} failed: missing columns {missing}")
+                continue
+            if shared_path is not None:
+                future = pool.submit(render_plot, name, None, RESULTS_DIR, force, shared_path,
+                                     output_options())
+            else:
+                future = pool.submit(render_plot, name, df[columns], RESULTS_DIR, force, None,
+                                     output_options())
+            futures[future] = name
+        
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                instrumentation.add_records(future.result())
+            except Exception as e:
+                failures[name] = str(e)
+                print(f"✗ {name} failed: {e}")
+    return failures
+
+
+@instrumented(rows_arg="df")
+def generate_all_plots(df, parallel=False, workers=None, force=False, shared_path=None,
+                       dpi=None, fmt=None, label=None, results_dir=None):
     """
     Generate all visualizations and summary statistics
     This is the main function to call from notebooks or main.py
+    With parallel=True each plot is rendered in a separate process (one at
+    a time instead when worker processes can't be started, see workers.py)
+    Plots whose inputs haven't changed are skipped unless force=True
+    shared_path lets the parallel workers read df from a published Arrow file
+    dpi/fmt change the output settings (e.g. dpi=100 for a quick preview)
+    label is the season range in the titles (default: the years in df)
+    results_dir writes this set of plots somewhere other than RESULTS_DIR
     """
-    print("\n" + "="*50)
-    print("GENERATING VISUALIZATIONS")
-    print("="*50 + "\n")
-    
-    # Generate plots
-    plot_grid_vs_finish(df)
-    plot_pit_stops_by_team(df)
-    plot_lap_variance_by_driver(df)
-    plot_correlation_heatmap(df)
-    plot_positions_gained_distribution(df)
-    
-    # Generate summary stats
-    stats = generate_summary_stats(df)
-    
-    print("✓ All visualizations generated successfully!")
-    print(f"✓ Check the '{RESULTS_DIR}/' folder for output files\n")
+    global RESULTS_DIR, PLOT_DPI, PLOT_FORMAT, SEASON_LABEL
+    if label is None and "year" in df.columns and len(df) > 0:
+        label = season_label(df["year"].unique())
+    
+    # These settings are only for this call, so put them all back after it
+    old_settings = RESULTS_DIR, PLOT_DPI, PLOT_FORMAT, SEASON_LABEL
+    configure_output(dpi, fmt, label)
+    if results_dir is not None:
+        RESULTS_DIR = Path(results_dir)
+    try:
+        print("\n" + "="*50)
+        print("GENERATING VISUALIZATIONS")
+        print("="*50 + "\n")
+        
+        # Generate plots
+        if parallel and not can_spawn():
+            print("✗ Can't start worker processes from here, rendering the plots one at a time")
+            parallel = False
+        if parallel:
+            failures = render_plots_parallel(df, workers, force, shared_path)
+            if failures:
+                print(f"✗ {len(failures)} plot(s) failed: {', '.join(sorted(failures))}")
+        else:
+            for name in PLOTS:
+                globals()[name](df, force=force)
+        
+        # Generate summary stats
+        stats = generate_summary_stats(df)
+        
+        print("✓ All visualizations generated successfully!")
+        print(f"✓ Check the '{RESULTS_DIR}/' folder for output files\n")
+    finally:
+        RESULTS_DIR, PLOT_DPI, PLOT_FORMAT, SEASON_LABEL = old_settings
     
     return stats
 
@@ -0,0 +1,91 @@
+"""
+Build several season reports in one pass
+The raw tables are loaded and the pit/lap aggregates computed once for
+the union of all requested seasons. Every metric is per driver per race,
+so each report is just a slice of that one merged table by year; only the
+plots and stats are made per range, each in its own results/<range>/ folder
+"""
+
+import importlib
+import json
+from pathlib import Path
+
+import analysis
+from instrumentation import stage
+from load_data import load_all_kaggle_data
+
+data_preprocessing = importlib.import_module("data preprocessing")
+
+
+def parse_years(text):
+    """
+    Turn a year range into a list of years
+    "2022-2024" -> [2022, 2023, 2024], "2023" -> [2023], "2019,2021" -> [2019, 2021]
+    """
+    years = []
+    for part in str(text).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = (int(y) for y in part.split("-", 1))
+            if end < start:
+                raise ValueError(f"year range {part} goes backwards")
+            years.extend(range(start, end + 1))
+        else:
+            years.append(int(part))
+    if not years:
+        raise ValueError(f"no years in {text!r}")
+    return sorted(set(years))
+
+
+def range_dir_name(years):
+    """Folder name for a set of seasons, e.g. 2022-2024 or 2019_2021"""
+    return analysis.season_label(years).replace(", ", "_")
+
+
+def run_batch(year_ranges, results_dir=analysis.RESULTS_DIR, db_file="f1_analysis.db",
+              refresh_cache=False, workers=1, save_db=True, concurrent_load=None,
+              **plot_options):
+    """
+    Write plots and summary stats for every range in year_ranges
+    (each a list of years, e.g. from parse_years) into results_dir/<range>/
+    The database gets the merged table for all the seasons together
+    concurrent_load is passed on to load_all_kaggle_data as concurrent
+    plot_options are passed on to generate_all_plots (parallel, force, dpi, fmt)
+    Returns a dict of range label -> summary stats
+    """
+    year_ranges = [sorted(set(years)) for years in year_ranges]
+    all_years = sorted(set(year for years in year_ranges for year in years))
+    print(f"Batch: {len(year_ranges)} report(s) covering {analysis.season_label(all_years)}")
+
+    # The expensive part, done once for every season at the same time
+    with stage("batch_load"):
+        data = load_all_kaggle_data(
+            years=all_years, refresh_cache=refresh_cache, concurrent=concurrent_load
+        )
+    if any(df is None for df in data.values()):
+        raise FileNotFoundError("failed to load some data files")
+    with stage("batch_merge"):
+        merged = data_preprocessing.merge_all_data(data, years=all_years, workers=workers)
+    if save_db:
+        with stage("batch_save"):
+            data_preprocessing.save_to_sqlite(merged, db_file)
+
+    all_stats = {}
+    for years in year_ranges:
+        label = analysis.season_label(years)
+        out_dir = Path(results_dir) / range_dir_name(years)
+        with stage(f"batch_report:{label}"):
+            subset = merged[merged["year"].isin(years)]
+            if len(subset) == 0:
+                print(f"\n✗ No results for {label}, skipping")
+                continue
+            print(f"\n--- {label}: {len(subset)} results -> {out_dir}/ ---")
+            stats = analysis.generate_all_plots(
+                subset, label=label, results_dir=out_dir, **plot_options
+            )
+            out_dir.mkdir(parents=True, exist_ok=True)
+            (out_dir / "summary_stats.json").write_text(json.dumps(stats, indent=2, default=float))
+        all_stats[label] = stats
+    return all_stats
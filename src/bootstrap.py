@@ -0,0 +1,144 @@
+"""
+Bootstrap confidence intervals for the team and driver rankings
+team_pit_times and driver_lap_variance rank by plain means, which says
+nothing about whether two teams are really different (one botched 30 s
+stop can move a team several places). This resamples every group's rows
+with replacement many times and reports, for each group, a percentile
+confidence interval for its mean and the probability that it ranks
+first, plus the probability that one group beats another
+
+All groups are resampled at once: one random (samples x rows) matrix of
+indices per chunk of samples, turned into group means with np.add.reduceat.
+Chunks get their own seeds spawned from one SeedSequence, so the result
+is the same for a given seed however many worker processes are used
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from workers import can_spawn, process_pool
+
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+SEED = 0
+CHUNK_SAMPLES = 250  # samples drawn per batch (and per task with workers)
+
+
+def resample_chunk(values, starts, counts, n_samples, seed):
+    """
+    Group means for n_samples bootstrap samples, as a (samples, groups) array
+    values must be sorted by group, with each group starting at starts
+    """
+    rng = np.random.default_rng(seed)
+    # Column j of the index matrix draws from the group row j belongs to
+    # (float32 draws are a third faster; the minimum guards against one
+    # rounding up to the group size)
+    row_start = np.repeat(starts, counts)
+    row_count = np.repeat(counts, counts)
+    draws = rng.random((n_samples, len(values)), dtype=np.float32)
+    offsets = np.minimum((draws * row_count.astype(np.float32)).astype(np.int64), row_count - 1)
+    return np.add.reduceat(values[row_start + offsets], starts, axis=1) / counts
+
+
+def resample_means(values, starts, counts, n_samples=BOOTSTRAP_SAMPLES, seed=SEED, workers=1):
+    """
+    Bootstrap group means in chunks of CHUNK_SAMPLES, in parallel with workers > 1
+    (spawned processes, see workers.py; serial where they can't be started)
+    Returns a (n_samples, groups) array
+    """
+    sizes = [min(CHUNK_SAMPLES, n_samples - i) for i in range(0, n_samples, CHUNK_SAMPLES)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and len(sizes) > 1 and can_spawn():
+        with process_pool(min(workers, len(sizes))) as pool:
+            chunks = list(pool.map(
+                resample_chunk, [values] * len(sizes), [starts] * len(sizes),
+                [counts] * len(sizes), sizes, seeds
+            ))
+    else:
+        chunks = [resample_chunk(values, starts, counts, size, s) for size, s in zip(sizes, seeds)]
+    return np.concatenate(chunks)
+
+
+def rank_probabilities(samples):
+    """
+    P(group i has a lower mean than group j) for every pair, from the
+    (samples, groups) bootstrap means, as a (groups, groups) array
+    """
+    n_groups = samples.shape[1]
+    wins = np.zeros((n_groups, n_groups))
+    for i in range(0, len(samples), CHUNK_SAMPLES):
+        chunk = samples[i:i + CHUNK_SAMPLES]
+        wins += (chunk[:, :, None] < chunk[:, None, :]).sum(axis=0)
+    return wins / len(samples)
+
+
+@instrumented(rows_arg="df")
+def bootstrap_ranking(df, group_col, value_col, n_samples=BOOTSTRAP_SAMPLES,
+                      confidence=CONFIDENCE, seed=SEED, workers=1):
+    """
+    Rank the groups in group_col by the mean of value_col, lowest first
+    Returns (summary, pairwise):
+      summary  - per group: mean, ci_low, ci_high, n and p_best (share of
+                 samples in which it had the lowest mean)
+      pairwise - P(row group has a lower mean than column group)
+    Rows where value_col is missing are ignored
+    """
+    data = df[[group_col, value_col]].dropna()
+    if len(data) == 0:
+        empty = pd.DataFrame(columns=["mean", "ci_low", "ci_high", "n", "p_best"])
+        return empty, pd.DataFrame()
+
+    codes, names = pd.factorize(data[group_col], sort=True)
+    order = np.argsort(codes, kind="stable")
+    values = data[value_col].to_numpy(dtype=np.float64)[order]
+    counts = np.bincount(codes, minlength=len(names))
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+
+    samples = resample_means(values, starts, counts, n_samples, seed, workers)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(samples, [tail, 100 - tail], axis=0)
+    best = np.bincount(samples.argmin(axis=1), minlength=len(names)) / len(samples)
+
+    summary = pd.DataFrame({
+        "mean": np.add.reduceat(values, starts) / counts,
+        "ci_low": low,
+        "ci_high": high,
+        "n": counts,
+        "p_best": best,
+    }, index=pd.Index(names, name=group_col))
+    pairwise = pd.DataFrame(rank_probabilities(samples), index=summary.index, columns=summary.index)
+
+    ranked = summary.sort_values("mean").index
+    return summary.loc[ranked], pairwise.loc[ranked, ranked]
+
+
+def team_pit_ci(df, **options):
+    """bootstrap_ranking of avg_pit_ms per team (the same order as team_pit_times)"""
+    return bootstrap_ranking(df, "team_name", "avg_pit_ms", **options)
+
+
+def driver_lap_variance_ci(df, min_races=10, top_n=None, **options):
+    """
+    bootstrap_ranking of lap_var_ms per driver with at least min_races
+    results (the same drivers and order as driver_lap_variance)
+    """
+    race_counts = df.groupby("driver_name").size()
+    valid = race_counts[race_counts >= min_races].index
+    summary, pairwise = bootstrap_ranking(
+        df[df["driver_name"].isin(valid)], "driver_name", "lap_var_ms", **options
+    )
+    if top_n is not None:
+        summary = summary.head(top_n)
+        pairwise = pairwise.loc[summary.index, summary.index]
+    return summary, pairwise
+
+
+def error_bars(summary):
+    """(2, groups) distances from each mean to its CI ends, for plt.bar(yerr=...)"""
+    return np.vstack([summary["mean"] - summary["ci_low"], summary["ci_high"] - summary["mean"]])
@@ -2,10 +2,17 @@
 Data cleaning and feature engineering for Formula 1 analysis
 """
 
+import os
+import numpy as np
 import pandas as pd
-import sqlite3
 from pathlib import Path
 
+from database import connect_db, write_race_metrics, table_exists, table_columns
+from load_data import CHUNK_SIZE, csv_options
+from instrumentation import instrumented
+from shared_dataset import publish
+from workers import can_spawn, process_pool
+
 YEARS = [2022, 2023, 2024]
 
 def filter_by_years(data, years=YEARS):
@@ -15,6 +22,15 @@ def filter_by_years(data, years=YEARS):
     print(f"Filtered to {len(races_filtered)} races from {years}")
     return races_filtered
 
+def filter_by_races(df, race_ids):
+    """
+    Keep only the rows that belong to the selected races (semi-join on raceId)
+    Doing this before the groupbys means we only aggregate the seasons we need
+    """
+    if df is None:
+        return df
+    return df[df["raceId"].isin(race_ids)]
+
 def calculate_positions_gained(results_df):
     """Calculate how many positions each driver gained/lost"""
     # grid position - final position (positive = gained positions)
@@ -40,57 +56,338 @@ def calculate_lap_variance(lap_times_df):
     lap_var = lap_var.rename(columns={"milliseconds": "lap_var_ms"})
     return lap_var
 
-def merge_all_data(data, years=YEARS):
+def lap_moments(lap_times_df):
+    """
+    Count, mean, M2 (sum of squared deviations) and fastest lap time
+    per driver per race - enough to combine chunks into the exact variance
+    """
+    grouped = lap_times_df.groupby(["raceId", "driverId"])["milliseconds"]
+    moments = grouped.agg(["count", "mean", "min"])
+    moments["m2"] = grouped.var(ddof=0) * moments["count"]
+    return moments
+
+def combine_moments(parts):
+    """
+    Merge several sets of (count, mean, m2, min) for the same groups
+    (Chan et al. parallel variance: the m2 of the union is the sum of the
+    parts' m2 plus each part's count * (its mean - overall mean)^2)
+    """
+    stacked = pd.concat(parts)
+    weighted = stacked["count"] * stacked["mean"]
+    totals = pd.DataFrame({"count": stacked["count"], "weighted": weighted})
+    totals = totals.groupby(level=[0, 1]).sum()
+    totals["mean"] = totals["weighted"] / totals["count"]
+    
+    overall_mean = totals["mean"].reindex(stacked.index)
+    spread = stacked["count"] * (stacked["mean"] - overall_mean) ** 2
+    totals["m2"] = (stacked["m2"] + spread).groupby(level=[0, 1]).sum()
+    totals["min"] = stacked["min"].groupby(level=[0, 1]).min()
+    return totals[["count", "mean", "m2", "min"]]
+
+def read_lap_chunks(path, chunksize=CHUNK_SIZE):
+    """
+    Yield lap_times in chunks from a CSV, or from a Parquet file one
+    row group batch at a time
+    """
+    path = Path(path)
+    columns = ["raceId", "driverId", "milliseconds"]
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        options = csv_options("lap_times.csv")
+        options["usecols"] = columns
+        yield from pd.read_csv(path, chunksize=chunksize, **options)
+
+@instrumented()
+def stream_lap_metrics(path, race_ids=None, chunksize=CHUNK_SIZE):
+    """
+    Lap metrics like lap_metrics(), but reads lap_times from disk chunk by
+    chunk, so memory depends on the chunk size and the number of
+    (race, driver) pairs instead of the size of the file
+    The median can't be merged across chunks, so lap_median_ms is NaN here
+    """
+    moments = None
+    for chunk in read_lap_chunks(path, chunksize):
+        if race_ids is not None:
+            chunk = filter_by_races(chunk, race_ids)
+        if len(chunk) == 0:
+            continue
+        chunk_moments = lap_moments(chunk)
+        if moments is None:
+            moments = chunk_moments
+        else:
+            moments = combine_moments([moments, chunk_moments])
+    
+    if moments is None:
+        return pd.DataFrame(columns=["raceId", "driverId"] + LAP_METRICS)
+    
+    # Sample variance (ddof=1) like groupby().var(); NaN for a single lap
+    lap_var = moments["m2"] / (moments["count"] - 1)
+    lap_var[moments["count"] < 2] = np.nan
+    
+    metrics = pd.DataFrame({
+        "lap_count": moments["count"].astype(np.float64),
+        "lap_mean_ms": moments["mean"],
+        "lap_var_ms": lap_var,
+        "lap_best_ms": moments["min"].astype(np.float64),
+        "lap_median_ms": np.nan
+    })
+    return metrics.reset_index()
+
+def stream_lap_variance(path, race_ids=None, chunksize=CHUNK_SIZE):
+    """
+    Same result as calculate_lap_variance, but streamed from disk
+    (see stream_lap_metrics)
+    """
+    lap_metrics_df = stream_lap_metrics(path, race_ids, chunksize)
+    return lap_metrics_df[["raceId", "driverId", "lap_var_ms"]]
+
+# Metric columns added to every result row by merge_all_data
+PIT_METRICS = ["pit_count", "avg_pit_ms", "pit_min_ms", "pit_total_ms"]
+LAP_METRICS = ["lap_count", "lap_mean_ms", "lap_var_ms", "lap_best_ms", "lap_median_ms"]
+
+def race_driver_keys(df):
+    """Pack (raceId, driverId) into one int64 so we can sort/search on it"""
+    race = df["raceId"].to_numpy(dtype=np.int64)
+    driver = df["driverId"].to_numpy(dtype=np.int64)
+    return (race << 32) | driver
+
+def sort_groups(keys, values):
+    """
+    Sort by key and then by value inside each key
+    Lap and pit times are whole, non-negative milliseconds, so we pack
+    (group number, value) into one int64 and do a single sort, which is
+    several times faster than np.lexsort on two arrays
+    """
+    whole = len(values) > 0 and values.min() >= 0 and values.max() < 2**31
+    whole = whole and np.array_equal(values, np.floor(values))
+    if not whole:
+        order = np.lexsort((values, keys))
+        return keys[order], values[order]
+    
+    # Dense group numbers in key order (the data is usually sorted by key
+    # already, so this stable sort is cheap)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    new_group = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    group_ids = np.cumsum(new_group) - 1
+    
+    packed = (group_ids << 32) | values[order].astype(np.int64)
+    packed.sort()
+    unique_keys = sorted_keys[new_group]
+    return unique_keys[packed >> 32], (packed & 0xFFFFFFFF).astype(np.float64)
+
+def grouped_stats(keys, values):
+    """
+    Count, sum, mean, variance, min and median of values per key in one
+    sorted pass: once every group is together with its values in order,
+    min and median are just positions inside each group
+    Returns the sorted unique keys and a dict of arrays (one entry per key)
+    """
+    values = values.astype(np.float64)
+    valid = ~np.isnan(values)
+    keys, values = keys[valid], values[valid]
+    
+    keys, values = sort_groups(keys, values)
+    if len(keys) == 0:
+        empty = np.array([], dtype=np.float64)
+        return keys, {name: empty for name in ["count", "sum", "mean", "var", "min", "median"]}
+    
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    sums = np.add.reduceat(values, starts)
+    means = sums / counts
+    
+    # Two-pass variance: squared deviations from each group's own mean
+    deviations = values - np.repeat(means, counts)
+    m2 = np.add.reduceat(deviations * deviations, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variances = np.where(counts > 1, m2 / (counts - 1), np.nan)
+    
+    low = starts + (counts - 1) // 2
+    high = starts + counts // 2
+    stats = {
+        "count": counts.astype(np.float64),
+        "sum": sums,
+        "mean": means,
+        "var": variances,
+        "min": values[starts],
+        "median": (values[low] + values[high]) / 2,
+    }
+    return keys[starts], stats
+
+def stats_frame(group_keys, columns):
+    """Turn grouped_stats output into a DataFrame with raceId/driverId columns"""
+    frame = pd.DataFrame({
+        "raceId": (group_keys >> 32).astype(np.int32),
+        "driverId": (group_keys & 0xFFFFFFFF).astype(np.int32),
+    })
+    for name, values in columns.items():
+        frame[name] = values
+    return frame
+
+@instrumented()
+def pit_metrics(pit_stops_df):
+    """Number of stops, mean, fastest and total pit time per driver per race"""
+    keys, stats = grouped_stats(race_driver_keys(pit_stops_df), pit_stops_df["milliseconds"].to_numpy())
+    return stats_frame(keys, {
+        "pit_count": stats["count"],
+        "avg_pit_ms": stats["mean"],
+        "pit_min_ms": stats["min"],
+        "pit_total_ms": stats["sum"],
+    })
+
+@instrumented()
+def lap_metrics(lap_times_df):
+    """Number of laps, mean, variance, best and median lap time per driver per race"""
+    keys, stats = grouped_stats(race_driver_keys(lap_times_df), lap_times_df["milliseconds"].to_numpy())
+    return stats_frame(keys, {
+        "lap_count": stats["count"],
+        "lap_mean_ms": stats["mean"],
+        "lap_var_ms": stats["var"],
+        "lap_best_ms": stats["min"],
+        "lap_median_ms": stats["median"],
+    })
+
+def attach_metrics(df, metrics, columns):
+    """
+    Add metric columns to df by looking up each row's (raceId, driverId)
+    in the sorted metrics table (rows with no match get NaN) - this avoids
+    the full copy a DataFrame.merge would make
+    """
+    metric_keys = race_driver_keys(metrics)
+    if len(metric_keys) == 0:
+        for col in columns:
+            df[col] = np.nan
+        return df
+    
+    row_keys = race_driver_keys(df)
+    pos = np.minimum(np.searchsorted(metric_keys, row_keys), len(metric_keys) - 1)
+    found = metric_keys[pos] == row_keys
+    
+    for col in columns:
+        values = np.full(len(df), np.nan)
+        values[found] = metrics[col].to_numpy(dtype=np.float64)[pos[found]]
+        df[col] = values
+    return df
+
+def split_by_race(df, race_groups):
+    """
+    Split a table into one piece per group of raceIds
+    Sorting once and slicing is much cheaper than calling isin per group
+    """
+    df = df.sort_values("raceId", kind="stable")
+    race_col = df["raceId"].to_numpy()
+    starts = np.searchsorted(race_col, [group[0] for group in race_groups], side="left")
+    ends = np.searchsorted(race_col, [group[-1] for group in race_groups], side="right")
+    return [df.iloc[start:end] for start, end in zip(starts, ends)]
+
+def aggregate_shard(pit_stops_df, lap_times_df):
+    """Pit and lap metrics for one shard of races (runs in a worker process)"""
+    return pit_metrics(pit_stops_df), lap_metrics(lap_times_df)
+
+@instrumented()
+def parallel_race_metrics(pit_stops_df, lap_times_df, workers=None):
+    """
+    Compute pit_metrics and lap_metrics on a process pool, with each
+    worker handling a contiguous block of races
+    Every (raceId, driverId) group lives in exactly one shard, so the
+    result is the same as the serial version
+    The workers are spawned (see workers.py): a script calling this needs
+    an `if __name__ == "__main__":` guard, and where workers can't be
+    started at all (code piped in on stdin) it runs serially
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    race_ids = np.union1d(pit_stops_df["raceId"].unique(), lap_times_df["raceId"].unique())
+    race_groups = [g for g in np.array_split(race_ids, workers) if len(g) > 0]
+    if len(race_groups) <= 1 or not can_spawn():
+        return aggregate_shard(pit_stops_df, lap_times_df)
+    
+    pit_shards = split_by_race(pit_stops_df, race_groups)
+    lap_shards = split_by_race(lap_times_df, race_groups)
+    
+    with process_pool(len(race_groups)) as pool:
+        results = list(pool.map(aggregate_shard, pit_shards, lap_shards))
+    
+    # Shards are in raceId order, so the concatenated keys stay sorted
+    pit = pd.concat([pit for pit, _ in results], ignore_index=True)
+    lap = pd.concat([lap for _, lap in results], ignore_index=True)
+    return pit, lap
+
+@instrumented()
+def merge_all_data(data, years=YEARS, race_ids=None, lap_times_path=None, workers=1,
+                   publish_path=None):
     """
     Main preprocessing function that combines everything
+    race_ids optionally narrows the selected years down to specific races
+    If lap_times_path is given, lap variance is streamed from that file
+    instead of using data["lap_times"]
+    workers > 1 (or None for all cores) computes the pit/lap metrics on a
+    process pool split by raceId (needs a __main__ guard in the calling
+    script, see parallel_race_metrics)
+    publish_path also writes the result there as a memory-mappable Arrow
+    file that other processes can open with shared_dataset.load_shared()
     """
     # Get filtered races
     races_filtered = filter_by_years(data, years)
+    if race_ids is not None:
+        races_filtered = filter_by_races(races_filtered, race_ids)
     races_subset = races_filtered[["raceId", "year", "name"]]
+    race_ids = races_subset["raceId"].unique()
     
-    # Merge results with race info
-    results = data["results"]
-    df = results.merge(races_subset, on="raceId")
+    # Results for those races, with race info looked up by raceId
+    df = filter_by_races(data["results"], race_ids).reset_index(drop=True)
+    races_by_id = races_subset.set_index("raceId")
+    df["year"] = df["raceId"].map(races_by_id["year"])
+    df["name"] = df["raceId"].map(races_by_id["name"])
     
     # Add positions gained
     df = calculate_positions_gained(df)
     
-    # Add pit stop metrics
-    pit_avg = calculate_avg_pit_time(data["pit_stops"])
-    df = df.merge(pit_avg, on=["raceId", "driverId"], how="left")
-    
-    # Add lap time variance
-    lap_var = calculate_lap_variance(data["lap_times"])
-    df = df.merge(lap_var, on=["raceId", "driverId"], how="left")
-    
-    # Add driver names
-    drivers = data["drivers"].copy()
-    drivers["driver_name"] = drivers["forename"] + " " + drivers["surname"]
-    df = df.merge(
-        drivers[["driverId", "code", "driver_name"]], 
-        on="driverId", 
-        how="left"
-    )
+    # Add pit stop and lap time metrics
+    # (filter first so we don't aggregate the whole archive back to 1996)
+    pit_stops = filter_by_races(data["pit_stops"], race_ids)
+    if lap_times_path is not None:
+        pit = pit_metrics(pit_stops)
+        lap = stream_lap_metrics(lap_times_path, race_ids)
+    else:
+        lap_times = filter_by_races(data["lap_times"], race_ids)
+        if workers == 1:
+            pit, lap = aggregate_shard(pit_stops, lap_times)
+        else:
+            pit, lap = parallel_race_metrics(pit_stops, lap_times, workers)
     
-    # Add team names
-    constructors = data["constructors"].copy()
-    constructors = constructors.rename(columns={"name": "team_name"})
-    df = df.merge(
-        constructors[["constructorId", "team_name"]], 
-        on="constructorId", 
-        how="left"
-    )
+    df = attach_metrics(df, pit, PIT_METRICS)
+    df = attach_metrics(df, lap, LAP_METRICS)
+    
+    # Add driver and team names
+    drivers = data["drivers"].set_index("driverId")
+    df["code"] = df["driverId"].map(drivers["code"])
+    df["driver_name"] = df["driverId"].map(drivers["forename"] + " " + drivers["surname"])
+    constructors = data["constructors"].set_index("constructorId")
+    df["team_name"] = df["constructorId"].map(constructors["name"])
     
     print(f"✓ Final dataset: {len(df)} rows")
+    if publish_path is not None:
+        publish(df, publish_path)
     return df
 
+@instrumented(rows_arg="df")
 def save_to_sqlite(df, db_file="f1_analysis.db"):
     """
     Save data to SQLite database
     (following the SQL concepts from class)
     """
-    conn = sqlite3.connect(db_file)
-    df.to_sql("race_metrics", conn, if_exists="replace", index=False)
+    conn = connect_db(db_file)
+    write_race_metrics(df, conn, replace=True)
+    # The table was rebuilt from scratch, so the incremental manifest is stale
+    conn.execute("DROP TABLE IF EXISTS race_manifest")
     
     # Test with a sample query
     test_query = """
@@ -108,3 +405,106 @@ def save_to_sqlite(df, db_file="f1_analysis.db"):
     
     conn.close()
     print(f"✓ Data saved to {db_file}")
+
+def table_race_hashes(df):
+    """
+    Hash every row of a table and add the hashes up per raceId
+    The sum doesn't depend on row order, so re-sorted files hash the same
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    return row_hashes.groupby(df["raceId"].to_numpy()).sum()
+
+def race_fingerprints(data, race_ids):
+    """
+    Fingerprint the inputs of each race (results, pit stops, lap times)
+    The driver and constructor tables are hashed once and mixed into every
+    race, since a renamed driver or team changes all of their rows
+    """
+    lookup_hash = 0
+    for key in ["drivers", "constructors"]:
+        lookup_hash += int(pd.util.hash_pandas_object(data[key], index=False).sum())
+    lookup_hash %= 2**64
+    
+    races = filter_by_races(data["races"], race_ids)
+    parts = [table_race_hashes(races)]
+    for key in ["results", "pit_stops", "lap_times"]:
+        parts.append(table_race_hashes(filter_by_races(data[key], race_ids)))
+    
+    fingerprints = {}
+    for race_id in race_ids:
+        hashes = [int(part.get(race_id, 0)) for part in parts]
+        fingerprints[int(race_id)] = "-".join(f"{h:016x}" for h in hashes + [lookup_hash])
+    return fingerprints
+
+def load_manifest(conn):
+    """Read the stored raceId -> fingerprint manifest (empty on a fresh DB)"""
+    if not table_exists(conn, "race_metrics") or not table_exists(conn, "race_manifest"):
+        return {}
+    
+    manifest = pd.read_sql_query("SELECT raceId, fingerprint FROM race_manifest", conn)
+    return {int(r): fp for r, fp in zip(manifest["raceId"], manifest["fingerprint"])}
+
+@instrumented()
+def update_race_metrics(data, years=YEARS, db_file="f1_analysis.db"):
+    """
+    Incremental version of merge_all_data + save_to_sqlite
+    Only races whose inputs changed since the last run are recomputed,
+    then their rows in race_metrics are deleted and written again
+    Returns the race_metrics rows for the selected years
+    """
+    races_filtered = filter_by_years(data, years)
+    race_ids = races_filtered["raceId"].tolist()
+    fingerprints = race_fingerprints(data, race_ids)
+    
+    conn = connect_db(db_file)
+    try:
+        manifest = load_manifest(conn)
+        changed = [r for r, fp in fingerprints.items() if manifest.get(r) != fp]
+        
+        if not changed:
+            print("✓ race_metrics is up to date, nothing to recompute")
+        else:
+            print(f"Recomputing {len(changed)} of {len(race_ids)} races...")
+            df_new = merge_all_data(data, years, race_ids=changed)
+            
+            # If the metric columns changed (e.g. after a code update) the
+            # new rows can't go in next to the old ones, so rebuild every race
+            if manifest and table_columns(conn) != list(df_new.columns):
+                print("race_metrics columns changed, rebuilding all races...")
+                changed = race_ids
+                df_new = merge_all_data(data, years)
+                manifest = {}
+            
+            if not manifest:
+                # Fresh database: start the tables from scratch
+                conn.execute("DROP TABLE IF EXISTS race_manifest")
+                conn.execute(
+                    "CREATE TABLE race_manifest (raceId INTEGER PRIMARY KEY, fingerprint TEXT)"
+                )
+                write_race_metrics(df_new, conn, replace=True)
+            else:
+                # Drop the old rows first in case a driver left the results
+                with conn:
+                    conn.executemany(
+                        "DELETE FROM race_metrics WHERE raceId = ?", [(r,) for r in changed]
+                    )
+                write_race_metrics(df_new, conn, replace=False)
+            
+            conn.executemany(
+                "INSERT OR REPLACE INTO race_manifest (raceId, fingerprint) VALUES (?, ?)",
+                [(r, fingerprints[r]) for r in changed]
+            )
+            conn.commit()
+            print(f"✓ Updated {len(df_new)} rows in {db_file}")
+        
+        placeholders = ",".join("?" * len(years))
+        df = pd.read_sql_query(
+            f"SELECT * FROM race_metrics WHERE year IN ({placeholders})",
+            conn,
+            params=list(years)
+        )
+    finally:
+        conn.close()
+    
+    print(f"✓ Final dataset: {len(df)} rows")
+    return df
@@ -0,0 +1,125 @@
+"""
+SQLite storage for the processed race_metrics table
+"""
+
+import sqlite3
+import pandas as pd
+
+from instrumentation import instrumented
+
+DB_FILE = "f1_analysis.db"
+BATCH_SIZE = 50_000
+
+# Settings for fast bulk writes: WAL lets readers keep querying while we
+# write, and synchronous=NORMAL is still safe in WAL mode
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,  # negative = size in KB, so about 64 MB
+}
+
+# Indexes for the team/driver/season queries. The metric is included in
+# the team and driver indexes so the GROUP BY can be answered from the
+# index alone without touching the table
+INDEXES = {
+    "idx_race_metrics_year": "year",
+    "idx_race_metrics_team": "team_name, avg_pit_ms",
+    "idx_race_metrics_driver": "driver_name, lap_var_ms",
+    "idx_race_metrics_race_driver": "raceId, driverId",
+}
+
+
+def connect_db(db_file=DB_FILE):
+    """Open the database with the bulk-write pragmas applied"""
+    conn = sqlite3.connect(db_file)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def sql_type(dtype):
+    """Map a pandas dtype to a SQLite column type"""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def table_exists(conn, table):
+    """Check if a table is already in the database"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def table_columns(conn, table="race_metrics"):
+    """Column names of a table, in order"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def create_race_metrics_table(conn, df):
+    """
+    Create a typed race_metrics table for the columns of df
+    resultId is the key when df has it: (raceId, driverId) isn't unique,
+    since early seasons had shared drives with several results per driver
+    """
+    columns = [f'"{col}" {sql_type(dtype)}' for col, dtype in df.dtypes.items()]
+    if "resultId" in df.columns:
+        columns.append("PRIMARY KEY (resultId)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS race_metrics ({', '.join(columns)})")
+
+
+def create_indexes(conn):
+    """Add the lookup indexes (skipped for columns the table doesn't have)"""
+    existing = set(table_columns(conn))
+    for name, columns in INDEXES.items():
+        needed = [col.strip() for col in columns.split(",")]
+        if all(col in existing for col in needed):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON race_metrics ({columns})")
+
+
+def insert_rows(conn, df, batch_size=BATCH_SIZE):
+    """
+    Insert a DataFrame with executemany, one transaction per batch
+    A duplicate resultId raises sqlite3.IntegrityError instead of
+    silently replacing the row that's already there
+    """
+    col_names = ", ".join(f'"{col}"' for col in df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    sql = f"INSERT INTO race_metrics ({col_names}) VALUES ({placeholders})"
+
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        # object dtype turns numpy scalars into plain Python values sqlite can bind
+        batch = batch.astype(object).where(batch.notna(), None)
+        with conn:
+            conn.executemany(sql, batch.itertuples(index=False, name=None))
+
+
+@instrumented(rows_arg="df")
+def write_race_metrics(df, conn, replace=True, batch_size=BATCH_SIZE):
+    """
+    Bulk-write race_metrics
+    replace=True rebuilds the table; otherwise rows are added to it (delete
+    the old rows of the races being rewritten first)
+    """
+    if replace:
+        conn.execute("DROP TABLE IF EXISTS race_metrics")
+
+    fresh = not table_exists(conn, "race_metrics")
+    create_race_metrics_table(conn, df)
+
+    if fresh:
+        # Building the indexes once after the load is faster than updating
+        # them on every insert
+        insert_rows(conn, df, batch_size)
+        create_indexes(conn)
+        # Give the query planner row counts for the new indexes
+        conn.execute("ANALYZE race_metrics")
+        conn.commit()
+    else:
+        create_indexes(conn)
+        insert_rows(conn, df, batch_size)
@@ -0,0 +1,214 @@
+"""
+Lightweight timing and memory instrumentation for the pipeline
+Wrap a block in `with stage("name"):` or a function in @instrumented(...)
+to record its wall time, CPU time, peak memory and row count. The records
+are kept in memory and written out as a JSON run report by main.py
+"""
+
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+MAX_RECORDS = 10_000  # oldest records are dropped after this many
+
+_records = deque(maxlen=MAX_RECORDS)
+_lock = threading.Lock()
+_local = threading.local()
+_run_start = time.perf_counter()
+
+
+def max_rss_mb():
+    """Highest resident memory of this process so far (None if unknown)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def count_rows(result):
+    """Rows in a result: a DataFrame, or a dict of DataFrames (None otherwise)"""
+    if hasattr(result, "shape") and hasattr(result, "columns"):
+        return len(result)
+    if isinstance(result, dict):
+        sizes = [len(v) for v in result.values() if hasattr(v, "columns")]
+        return sum(sizes) if sizes else None
+    return None
+
+
+def start_memory_tracing():
+    """
+    Turn on tracemalloc so stages also get a Python-level peak_traced_mb
+    (it makes allocation-heavy code noticeably slower, so it's opt-in)
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def _stack():
+    """Records of the stages currently open in this thread"""
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Record one stage of the pipeline
+    Yields the record dict so the block can fill in "rows" or other details
+    Stages opened inside another stage are recorded with it as their parent
+    """
+    stack = _stack()
+    record = {
+        "name": name,
+        "parent": stack[-1]["name"] if stack else None,
+        "depth": len(stack),
+        "start_s": round(time.perf_counter() - _run_start, 4),
+        "rows": None,
+        **info,
+    }
+    with _lock:
+        _records.append(record)
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # Keep the parent's peak so far before resetting it for this stage
+        if stack:
+            stack[-1]["_peak"] = max(stack[-1]["_peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    record["_peak"] = 0
+
+    stack.append(record)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["wall_s"] = round(time.perf_counter() - wall, 4)
+        record["cpu_s"] = round(time.process_time() - cpu, 4)
+        record["max_rss_mb"] = max_rss_mb()
+        stack.pop()
+        peak = record.pop("_peak")
+        if tracing and tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            record["peak_traced_mb"] = round(peak / 1e6, 2)
+            if stack:
+                stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+
+
+def instrumented(name=None, label_arg=None, rows_arg=None):
+    """
+    Decorator version of stage() that also counts the rows of the result
+    label_arg names an argument to add to the stage name, e.g.
+    @instrumented("load_csv", label_arg="filename") -> "load_csv:races.csv"
+    rows_arg counts the rows of that argument instead (for functions that
+    write or plot a DataFrame rather than return one)
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+        # follow_wrapped=False so extra keywords added by other decorators
+        # (like force= from cached_plot) still bind
+        signature = inspect.signature(func, follow_wrapped=False) if (label_arg or rows_arg) else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            full_name = stage_name
+            arguments = {}
+            if signature is not None:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+            if label_arg in arguments:
+                full_name = f"{stage_name}:{arguments[label_arg]}"
+            with stage(full_name) as record:
+                if rows_arg:
+                    record["rows"] = count_rows(arguments.get(rows_arg))
+                result = func(*args, **kwargs)
+                if not rows_arg:
+                    record["rows"] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def get_records():
+    """Copy of everything recorded so far, in the order the stages started"""
+    with _lock:
+        return [
+            {key: value for key, value in record.items() if not key.startswith("_")}
+            for record in _records
+        ]
+
+
+def add_records(records):
+    """
+    Add records made in another process (e.g. a plot worker) as children
+    of the stage currently open in this thread
+    """
+    stack = _stack()
+    parent = stack[-1]["name"] if stack else None
+    with _lock:
+        for record in records:
+            record = dict(record)
+            if record["depth"] == 0:
+                record["parent"] = parent
+            record["depth"] += len(stack)
+            _records.append(record)
+
+
+def reset():
+    """
+    Forget all records (e.g. between runs in the same process)
+    Also forgets open stages, which a forked worker inherits from its parent
+    """
+    global _run_start
+    with _lock:
+        _records.clear()
+    _stack().clear()
+    _run_start = time.perf_counter()
+
+
+def write_report(path, **extra):
+    """Write the run report as JSON and return its path"""
+    records = get_records()
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "pid": os.getpid(),
+        "memory_traced": tracemalloc.is_tracing(),
+        **extra,
+        "total_wall_s": round(time.perf_counter() - _run_start, 4),
+        "max_rss_mb": max_rss_mb(),
+        "stages": records,
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, default=str))
+    return path
+
+
+def print_summary(max_depth=0):
+    """Print wall/CPU time of the top-level stages (deeper with max_depth)"""
+    print(f"\n{'stage':<32} {'wall s':>8} {'cpu s':>8} {'rows':>10}")
+    for record in get_records():
+        if record["depth"] > max_depth or "wall_s" not in record:
+            continue
+        name = "  " * record["depth"] + record["name"]
+        rows = "" if record["rows"] is None else f"{record['rows']:,}"
+        print(f"{name:<32} {record['wall_s']:>8.3f} {record['cpu_s']:>8.3f} {rows:>10}")
@@ -0,0 +1,223 @@
+"""
+Lap-level features built from lap_times and pit_stops
+Flags in-laps, out-laps and the opening lap, splits each driver's race
+into stints, removes outlier laps (safety car, incidents) with a robust
+median/MAD filter, and computes rolling pace and per-stint degradation
+
+Everything works on flat NumPy arrays sorted by (raceId, driverId, lap),
+so the cost grows linearly with the number of laps (plus one sort if the
+input isn't already in that order)
+"""
+
+import importlib
+
+import numpy as np
+import pandas as pd
+
+data_preprocessing = importlib.import_module("data preprocessing")
+grouped_stats = data_preprocessing.grouped_stats
+race_driver_keys = data_preprocessing.race_driver_keys
+
+MAD_THRESHOLD = 3.5  # robust z-score above which a lap counts as an outlier
+MAD_SCALE = 1.4826  # makes the MAD comparable to a standard deviation
+ROLLING_WINDOW = 5  # laps
+
+
+def lap_keys(race, driver, lap):
+    """Pack (raceId, driverId, lap) into one sortable int64"""
+    return (race.astype(np.int64) << 40) | (driver.astype(np.int64) << 16) | lap.astype(np.int64)
+
+
+def sorted_laps(lap_times_df):
+    """
+    lap_times sorted by (raceId, driverId, lap)
+    The Kaggle file is already in that order, in which case no sort happens
+    """
+    df = lap_times_df[["raceId", "driverId", "lap", "milliseconds"]]
+    keys = lap_keys(df["raceId"].to_numpy(), df["driverId"].to_numpy(), df["lap"].to_numpy())
+    if len(keys) > 1 and not np.all(keys[1:] >= keys[:-1]):
+        order = np.argsort(keys, kind="stable")
+        df = df.iloc[order]
+        keys = keys[order]
+    return df.reset_index(drop=True), keys
+
+
+def group_starts(group_ids):
+    """Index where each row's group starts (rows must be grouped together)"""
+    is_start = np.r_[True, group_ids[1:] != group_ids[:-1]]
+    start_positions = np.flatnonzero(is_start)
+    return start_positions[np.cumsum(is_start) - 1], is_start
+
+
+def grouped_cumsum(values, starts):
+    """Cumulative sum that restarts at every group start"""
+    total = np.cumsum(values)
+    before = total - values
+    return total - before[starts]
+
+
+def per_row(stat, group_keys, row_keys):
+    """Spread a per-group statistic back onto the rows of each group"""
+    return stat[np.searchsorted(group_keys, row_keys)]
+
+
+def contains(sorted_keys, keys):
+    """Vectorized membership test of keys in an already sorted key array"""
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[pos] == keys
+
+
+def mark_outliers(race_driver, lap_ms, candidate, threshold=MAD_THRESHOLD):
+    """
+    Flag laps far from their driver's median lap in that race
+    robust z = |lap - median| / (1.4826 * MAD), computed over candidate laps
+    """
+    outlier = np.zeros(len(lap_ms), dtype=bool)
+    if not candidate.any():
+        return outlier
+
+    keys = race_driver[candidate]
+    values = lap_ms[candidate]
+    group_keys, stats = grouped_stats(keys, values)
+    median = per_row(stats["median"], group_keys, keys)
+
+    deviation = np.abs(values - median)
+    _, dev_stats = grouped_stats(keys, deviation)
+    mad = per_row(dev_stats["median"], group_keys, keys) * MAD_SCALE
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        robust_z = np.where(mad > 0, deviation / mad, 0.0)
+    outlier[candidate] = robust_z > threshold
+    return outlier
+
+
+def rolling_pace(stint_keys, lap_ms, clean, window=ROLLING_WINDOW):
+    """
+    Mean of the last `window` clean laps of the same stint for each clean
+    lap (NaN otherwise)
+    Uses running sums, so every lap costs the same whatever the window
+    """
+    pace = np.full(len(lap_ms), np.nan)
+    if not clean.any():
+        return pace
+
+    values = lap_ms[clean]
+    starts, _ = group_starts(stint_keys[clean])
+    running = np.cumsum(values)
+    idx = np.arange(len(values))
+    window_start = np.maximum(idx - window + 1, starts)
+    window_sum = running - np.where(window_start > 0, running[window_start - 1], 0.0)
+    pace[clean] = window_sum / (idx - window_start + 1)
+    return pace
+
+
+def build_lap_features(lap_times_df, pit_stops_df, window=ROLLING_WINDOW, threshold=MAD_THRESHOLD):
+    """
+    One row per lap with:
+      is_first_lap, is_in_lap, is_out_lap - laps that aren't representative
+      stint        - 1 for the first stint, +1 after every pit stop
+      is_outlier   - failed the median/MAD filter
+      is_clean     - none of the above
+      rolling_pace_ms - mean of the last `window` clean laps in the stint
+    """
+    laps, keys = sorted_laps(lap_times_df)
+    race = laps["raceId"].to_numpy()
+    driver = laps["driverId"].to_numpy()
+    lap = laps["lap"].to_numpy()
+    lap_ms = laps["milliseconds"].to_numpy(dtype=np.float64)
+    race_driver = race_driver_keys(laps)
+
+    # A stop on lap L makes L the in-lap and L + 1 the out-lap
+    pit_keys = np.sort(lap_keys(
+        pit_stops_df["raceId"].to_numpy(),
+        pit_stops_df["driverId"].to_numpy(),
+        pit_stops_df["lap"].to_numpy(),
+    ))
+    in_lap = contains(pit_keys, keys)
+    out_lap = contains(pit_keys, keys - 1)
+    first_lap = lap == 1
+
+    # Stints: count the out-laps seen so far within each driver's race
+    starts, _ = group_starts(race_driver)
+    stint = grouped_cumsum(out_lap.astype(np.int64), starts) + 1
+
+    candidate = ~(in_lap | out_lap | first_lap)
+    outlier = mark_outliers(race_driver, lap_ms, candidate, threshold)
+    clean = candidate & ~outlier
+
+    features = pd.DataFrame({
+        "raceId": race,
+        "driverId": driver,
+        "lap": lap,
+        "milliseconds": lap_ms,
+        "stint": stint,
+        "is_first_lap": first_lap,
+        "is_in_lap": in_lap,
+        "is_out_lap": out_lap,
+        "is_outlier": outlier,
+        "is_clean": clean,
+    })
+    stint_keys = lap_keys(race, driver, stint)
+    features["rolling_pace_ms"] = rolling_pace(stint_keys, lap_ms, clean, window)
+    return features
+
+
+def stint_summary(features):
+    """
+    One row per (raceId, driverId, stint) with its clean-lap pace and the
+    degradation slope: least-squares ms lost per lap over the stint's
+    clean laps (positive = getting slower as the tyres wear)
+    """
+    clean = features[features["is_clean"]]
+    race = clean["raceId"].to_numpy(dtype=np.int64)
+    driver = clean["driverId"].to_numpy(dtype=np.int64)
+    stint = clean["stint"].to_numpy(dtype=np.int64)
+    x = clean["lap"].to_numpy(dtype=np.float64)
+    y = clean["milliseconds"].to_numpy(dtype=np.float64)
+
+    columns = ["raceId", "driverId", "stint", "first_lap", "last_lap",
+               "clean_laps", "mean_ms", "degradation_ms_per_lap"]
+    if len(clean) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # Features are sorted by lap, so each stint's rows are already together
+    stint_keys = lap_keys(race, driver, stint)
+    _, is_start = group_starts(stint_keys)
+    starts = np.flatnonzero(is_start)
+    n = np.diff(np.r_[starts, len(x)]).astype(np.float64)
+
+    sum_x = np.add.reduceat(x, starts)
+    sum_y = np.add.reduceat(y, starts)
+    sum_xx = np.add.reduceat(x * x, starts)
+    sum_xy = np.add.reduceat(x * y, starts)
+    denominator = n * sum_xx - sum_x ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denominator > 0, (n * sum_xy - sum_x * sum_y) / denominator, np.nan)
+
+    ends = np.r_[starts[1:], len(x)] - 1
+    return pd.DataFrame({
+        "raceId": race[starts],
+        "driverId": driver[starts],
+        "stint": stint[starts],
+        "first_lap": x[starts].astype(np.int64),
+        "last_lap": x[ends].astype(np.int64),
+        "clean_laps": n.astype(np.int64),
+        "mean_ms": sum_y / n,
+        "degradation_ms_per_lap": slope,
+    }, columns=columns)
+
+
+def clean_lap_variance(features):
+    """
+    Lap time variance per driver per race using clean laps only
+    A less noisy version of lap_var_ms for the consistency ranking
+    """
+    clean = features[features["is_clean"]]
+    group_keys, stats = grouped_stats(race_driver_keys(clean), clean["milliseconds"].to_numpy())
+    return pd.DataFrame({
+        "raceId": (group_keys >> 32).astype(np.int32),
+        "driverId": (group_keys & 0xFFFFFFFF).astype(np.int32),
+        "lap_var_clean_ms": stats["var"],
+    })
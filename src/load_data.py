@@ -3,58 +3,389 @@ Load F1 data from Kaggle CSVs and OpenF1 API
 """
 
 from pathlib import Path
+import hashlib
+import importlib.util
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-import requests
+
+import openf1_client
+from instrumentation import instrumented
+from workers import can_spawn, process_pool
 
 DATA_DIR = Path("data")
 
-def load_csv(filename):
-    """Load a CSV file from the data folder"""
+# Tables that have a raceId column and can be filtered while reading
+RACE_TABLES = ["results", "pit_stops", "lap_times"]
+CHUNK_SIZE = 100_000
+
+# Parsed tables are cached in data/.cache as "feather" or "parquet" files
+# (both need pyarrow; without it we just parse the CSVs every time)
+CACHE_DIR_NAME = ".cache"
+CACHE_FORMAT = "feather"
+
+# The Ergast dumps use \N for missing values
+NA_VALUES = ["\\N"]
+
+# Columns we actually use from each file, with compact dtypes
+# (ids fit in int32, laps/positions in int16; names we group by stay as
+# plain strings so groupby doesn't return empty categories)
+SCHEMAS = {
+    "races.csv": {
+        "raceId": "int32",
+        "year": "int16",
+        "round": "int16",
+        "name": "category",
+        "date": "object",
+    },
+    "results.csv": {
+        "resultId": "int32",
+        "raceId": "int32",
+        "driverId": "int32",
+        "constructorId": "int32",
+        "grid": "int16",
+        "position": "Int16",
+        "positionOrder": "int16",
+        "points": "float32",
+        "laps": "int16",
+        "statusId": "int16",
+    },
+    "pit_stops.csv": {
+        "raceId": "int32",
+        "driverId": "int32",
+        "stop": "int8",
+        "lap": "int16",
+        "milliseconds": "int32",
+    },
+    "lap_times.csv": {
+        "raceId": "int32",
+        "driverId": "int32",
+        "lap": "int16",
+        "position": "int16",
+        "milliseconds": "int32",
+    },
+    "drivers.csv": {
+        "driverId": "int32",
+        "code": "object",
+        "forename": "object",
+        "surname": "object",
+    },
+    "constructors.csv": {
+        "constructorId": "int32",
+        "name": "object",
+    },
+}
+
+def has_pyarrow():
+    """Check if pyarrow is installed (without importing it)"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+def csv_options(filename, engine="c"):
+    """
+    Build the read_csv arguments for a file from its schema
+    Files without a schema are read with pandas defaults
+    """
+    options = {"na_values": NA_VALUES}
+    schema = SCHEMAS.get(filename)
+    if schema is not None:
+        options["usecols"] = list(schema)
+        options["dtype"] = schema
+    
+    if engine == "pyarrow":
+        if has_pyarrow():
+            options["engine"] = "pyarrow"
+            if schema is not None:
+                # pyarrow would turn "object" columns like date into dates
+                options["dtype"] = {
+                    col: (str if dtype == "object" else dtype) for col, dtype in schema.items()
+                }
+        else:
+            print("pyarrow not installed, using the default CSV parser")
+    return options
+
+def read_csv(filepath, **options):
+    """
+    pd.read_csv, but with the pyarrow parser's output matching the default one
+    (pyarrow leaves na_values like \\N in text columns)
+    """
+    df = pd.read_csv(filepath, **options)
+    if options.get("engine") == "pyarrow":
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].mask(df[col].isin(NA_VALUES))
+    return df
+
+def read_race_rows(filepath, race_ids, chunksize=CHUNK_SIZE, **read_kwargs):
+    """
+    Read a CSV in chunks and only keep rows for the given races
+    This way the full lap_times history never has to sit in memory
+    """
+    race_ids = set(race_ids)
+    chunks = []
+    for chunk in pd.read_csv(filepath, chunksize=chunksize, **read_kwargs):
+        chunks.append(chunk[chunk["raceId"].isin(race_ids)])
+    return pd.concat(chunks, ignore_index=True)
+
+def file_hash(filepath):
+    """SHA-256 of a file, read in 1 MB blocks"""
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_paths(filename):
+    """Where the cached table and its metadata go for a CSV file"""
+    cache_dir = DATA_DIR / CACHE_DIR_NAME
+    stem = Path(filename).stem
+    return cache_dir / f"{stem}.{CACHE_FORMAT}", cache_dir / f"{stem}.json"
+
+def cache_signature(filename):
+    """Schema and format the cache was built with (changing either rebuilds it)"""
+    return {"format": CACHE_FORMAT, "schema": SCHEMAS.get(filename)}
+
+def is_cache_valid(filepath, meta):
+    """
+    Check if the cached copy still matches the CSV file
+    Size and mtime are checked first; if only the mtime changed (e.g. the
+    file was re-downloaded with the same contents) we compare the hash
+    """
+    stat = filepath.stat()
+    if stat.st_size != meta.get("size"):
+        return False
+    if stat.st_mtime_ns == meta.get("mtime_ns"):
+        return True
+    return file_hash(filepath) == meta.get("sha256")
+
+def read_cache(filename, race_ids=None):
+    """Load a table from the cache, or return None if it's missing or stale"""
+    table_path, meta_path = cache_paths(filename)
+    if not table_path.exists() or not meta_path.exists():
+        return None
+    
+    meta = json.loads(meta_path.read_text())
+    if meta.get("signature") != cache_signature(filename):
+        return None
     filepath = DATA_DIR / filename
+    if not is_cache_valid(filepath, meta):
+        return None
+    
+    # Same contents but a new mtime: remember it so we skip the hash next time
+    mtime_ns = filepath.stat().st_mtime_ns
+    if meta["mtime_ns"] != mtime_ns:
+        meta["mtime_ns"] = mtime_ns
+        meta_path.write_text(json.dumps(meta))
+    
+    if CACHE_FORMAT == "parquet":
+        filters = None
+        if race_ids is not None:
+            filters = [("raceId", "in", list(race_ids))]
+        return pd.read_parquet(table_path, filters=filters)
+    
+    df = pd.read_feather(table_path)
+    if race_ids is not None:
+        df = df[df["raceId"].isin(race_ids)].reset_index(drop=True)
+    return df
+
+def write_cache(filename, df):
+    """Save a parsed table to the cache along with the CSV's fingerprint"""
+    filepath = DATA_DIR / filename
+    table_path, meta_path = cache_paths(filename)
+    table_path.parent.mkdir(exist_ok=True)
+    
+    stat = filepath.stat()
+    meta = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": file_hash(filepath),
+        "signature": cache_signature(filename),
+    }
+    
+    # Write to a temp file first so a crash never leaves a half-written cache
+    tmp_path = table_path.with_name(table_path.name + ".tmp")
+    if CACHE_FORMAT == "parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(tmp_path)
+    os.replace(tmp_path, table_path)
+    meta_path.write_text(json.dumps(meta))
+
+@instrumented("load_csv", label_arg="filename")
+def load_csv(filename, race_ids=None, engine="c", use_cache=True, refresh_cache=False):
+    """
+    Load a CSV file from the data folder
+    Only the columns in SCHEMAS are read, with compact dtypes
+    If race_ids is given, only rows for those races are kept
+    With use_cache the parsed table is reused from data/.cache until the CSV
+    changes; refresh_cache=True forces it to be rebuilt
+    """
+    filepath = DATA_DIR / filename
+    options = csv_options(filename, engine)
+    use_cache = use_cache and has_pyarrow()
     try:
-        df = pd.read_csv(filepath)
+        if use_cache and not refresh_cache:
+            if not filepath.exists():
+                raise FileNotFoundError(filepath)
+            df = read_cache(filename, race_ids)
+            if df is not None:
+                print(f"✓ Loaded {filename}: {len(df)} rows (cached)")
+                return df
+        
+        if use_cache:
+            # Parse the whole file once so the cache can serve any year range
+            df = read_csv(filepath, **options)
+            write_cache(filename, df)
+            if race_ids is not None:
+                df = df[df["raceId"].isin(race_ids)].reset_index(drop=True)
+        elif race_ids is None:
+            df = read_csv(filepath, **options)
+        elif options.get("engine") == "pyarrow":
+            # pyarrow can't read in chunks, but it's fast enough to filter after
+            df = read_csv(filepath, **options)
+            df = df[df["raceId"].isin(race_ids)].reset_index(drop=True)
+        else:
+            df = read_race_rows(filepath, race_ids, **options)
         print(f"✓ Loaded {filename}: {len(df)} rows")
         return df
     except FileNotFoundError:
         print(f"✗ Error: {filename} not found in data/ folder")
         return None
 
-def load_all_kaggle_data():
-    """Load all the F1 CSV files we need"""
+# Table name -> CSV file in the data folder
+KAGGLE_FILES = {
+    "races": "races.csv",
+    "results": "results.csv",
+    "pit_stops": "pit_stops.csv",
+    "lap_times": "lap_times.csv",
+    "drivers": "drivers.csv",
+    "constructors": "constructors.csv"
+}
+
+def load_csv_worker(data_dir, filename, kwargs):
+    """load_csv in a worker process (which may not share our DATA_DIR)"""
+    global DATA_DIR
+    DATA_DIR = Path(data_dir)
+    return load_csv(filename, **kwargs)
+
+def load_files_concurrently(jobs, mode="threads", workers=None):
+    """
+    Load several CSVs at the same time
+    jobs is a list of (key, filename, load_csv kwargs). mode "threads" suits
+    the pyarrow parser, which releases the GIL; "processes" works with any
+    parser but has to pickle each table back. The processes are spawned
+    (see workers.py), so a script using them needs a __main__ guard; where
+    they can't be started (code piped in on stdin) threads are used instead
+    Returns (data, errors): key -> DataFrame (None on failure) and
+    key -> error message for the files that failed
+    """
+    if workers is None:
+        workers = len(jobs)
+    
+    data = {}
+    errors = {}
+    if mode == "processes" and not can_spawn():
+        mode = "threads"
+    if mode == "processes":
+        pool = process_pool(workers)
+        submit = lambda filename, kwargs: pool.submit(load_csv_worker, str(DATA_DIR), filename, kwargs)
+    elif mode == "threads":
+        pool = ThreadPoolExecutor(max_workers=workers)
+        submit = lambda filename, kwargs: pool.submit(load_csv, filename, **kwargs)
+    else:
+        raise ValueError(f"unknown mode {mode!r} (use 'threads' or 'processes')")
+    
+    with pool:
+        futures = {submit(filename, kwargs): (key, filename) for key, filename, kwargs in jobs}
+        for future in as_completed(futures):
+            key, filename = futures[future]
+            try:
+                data[key] = future.result()
+                if data[key] is None:
+                    errors[key] = f"{filename} not found in {DATA_DIR}/"
+            except Exception as e:
+                data[key] = None
+                errors[key] = f"{filename}: {type(e).__name__}: {e}"
+    return data, errors
+
+@instrumented()
+def load_all_kaggle_data(years=None, engine="c", use_cache=True, refresh_cache=False,
+                         tables=None, concurrent=None, workers=None):
+    """
+    Load all the F1 CSV files we need
+    If years is given, the race tables are filtered to those seasons while reading
+    engine can be "c" (pandas default) or "pyarrow" if it's installed
+    use_cache/refresh_cache are passed on to load_csv
+    tables optionally limits which tables are loaded (e.g. to skip lap_times)
+    concurrent loads the files at the same time: "threads", "processes", or
+    True for threads with the pyarrow parser if it's installed (processes
+    otherwise). Files that fail are None in the result and listed together
+    """
     print("Loading Kaggle F1 data...")
     
-    files = {
-        "races": "races.csv",
-        "results": "results.csv",
-        "pit_stops": "pit_stops.csv",
-        "lap_times": "lap_times.csv",
-        "drivers": "drivers.csv",
-        "constructors": "constructors.csv"
-    }
+    files = KAGGLE_FILES
+    if tables is not None:
+        files = {key: KAGGLE_FILES[key] for key in tables}
+    
+    mode = concurrent
+    if mode is True:
+        mode = "threads" if has_pyarrow() else "processes"
+    if mode == "threads" and has_pyarrow():
+        engine = "pyarrow"
+    options = {"engine": engine, "use_cache": use_cache, "refresh_cache": refresh_cache}
     
     data = {}
+    errors = {}
+    race_ids = None
+    if years is not None and "races" in files:
+        # Load races first so we know which raceIds to keep (it's tiny)
+        data["races"] = load_csv(files["races"], **options)
+        if data["races"] is not None:
+            races = data["races"]
+            race_ids = races.loc[races["year"].isin(years), "raceId"].tolist()
+        else:
+            errors["races"] = f"{files['races']} not found in {DATA_DIR}/"
+    
+    jobs = []
     for key, filename in files.items():
-        data[key] = load_csv(filename)
+        if key in data:
+            continue
+        kwargs = dict(options)
+        if key in RACE_TABLES:
+            kwargs["race_ids"] = race_ids
+        jobs.append((key, filename, kwargs))
+    
+    if mode and len(jobs) > 1:
+        loaded, load_errors = load_files_concurrently(jobs, mode, workers)
+        errors.update(load_errors)
+    else:
+        loaded = {}
+        for key, filename, kwargs in jobs:
+            loaded[key] = load_csv(filename, **kwargs)
+            if loaded[key] is None:
+                errors[key] = f"{filename} not found in {DATA_DIR}/"
+    
+    # Same key order as KAGGLE_FILES whatever order the files finished in
+    for key, _, _ in jobs:
+        data[key] = loaded[key]
+    data = {key: data[key] for key in files}
     
+    if errors:
+        print(f"✗ {len(errors)} file(s) failed to load:")
+        for key in files:
+            if key in errors:
+                print(f"  - {errors[key]}")
     return data
 
 def fetch_openf1_drivers(year=2023):
     """
     Fetch driver info from OpenF1 API
     Returns DataFrame with driver metadata
+    (cached on disk by openf1_client, so repeated runs don't hit the API)
     """
-    url = f"https://api.openf1.org/v1/drivers?year={year}"
-    
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            drivers_data = response.json()
-            df = pd.DataFrame(drivers_data)
-            print(f"✓ Fetched {len(df)} drivers from OpenF1 API")
-            return df
-        else:
-            print(f"API request failed: {response.status_code}")
-            return None
+        df = openf1_client.fetch_dataframe("drivers", {"year": year})
+        print(f"✓ Fetched {len(df)} drivers from OpenF1 API")
+        return df
     except Exception as e:
         print(f"Error fetching API data: {e}")
         return None
@@ -0,0 +1,135 @@
+"""
+Client for the OpenF1 API (https://openf1.org)
+Uses one pooled requests.Session with timeouts and retries, and caches
+responses on disk so repeated runs don't hit the network
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+BASE_URL = "https://api.openf1.org/v1"
+CACHE_DIR = Path("data") / ".cache" / "openf1"
+CACHE_TTL = 24 * 60 * 60  # seconds
+TIMEOUT = (5, 30)  # (connect, read) in seconds
+RETRIES = 3
+BACKOFF = 0.5  # seconds, doubled on every retry
+MAX_WORKERS = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Shared requests.Session, created on first use
+    The connection pool is sized for MAX_WORKERS threads and failed GETs
+    (connection errors, 429 and 5xx responses) are retried with backoff
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                total=RETRIES,
+                backoff_factor=BACKOFF,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+            )
+            adapter = HTTPAdapter(
+                pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def cache_path(url, params):
+    """Cache file for a request (named by a hash of the URL and parameters)"""
+    key = json.dumps([url, sorted((params or {}).items())], default=str)
+    return CACHE_DIR / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+
+def read_cached(path, ttl):
+    """Return the cached JSON if the file is younger than ttl seconds"""
+    if not path.exists():
+        return None
+    if time.time() - path.stat().st_mtime > ttl:
+        return None
+    return json.loads(path.read_text())
+
+
+def write_cached(path, data):
+    """Save a response to the cache (via a temp file so threads don't clash)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def fetch(endpoint, params=None, base_url=BASE_URL, ttl=CACHE_TTL, use_cache=True):
+    """
+    GET an OpenF1 endpoint (e.g. "drivers") and return the parsed JSON
+    Responses are cached for ttl seconds; errors are raised to the caller
+    """
+    url = f"{base_url.rstrip('/')}/{endpoint}"
+    path = cache_path(url, params)
+    if use_cache:
+        cached = read_cached(path, ttl)
+        if cached is not None:
+            return cached
+
+    response = get_session().get(url, params=params, timeout=TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+
+    if use_cache:
+        write_cached(path, data)
+    return data
+
+
+def fetch_dataframe(endpoint, params=None, **kwargs):
+    """Same as fetch() but returns a DataFrame"""
+    return pd.DataFrame(fetch(endpoint, params, **kwargs))
+
+
+def fetch_many(jobs, workers=MAX_WORKERS, **kwargs):
+    """
+    Fetch several (endpoint, params) jobs at once on a thread pool
+    e.g. [("drivers", {"year": 2023}), ("sessions", {"year": 2023})]
+    Returns (results, errors): both lists line up with jobs, with a
+    DataFrame or None in results and None or the error message in errors
+    """
+    results = [None] * len(jobs)
+    errors = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_dataframe, endpoint, params, **kwargs): i
+            for i, (endpoint, params) in enumerate(jobs)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[i] = str(e)
+                print(f"✗ OpenF1 {jobs[i][0]} {jobs[i][1]} failed: {e}")
+    return results, errors
+
+
+def fetch_season(year, endpoints=("drivers", "sessions", "meetings"), **kwargs):
+    """Fetch several endpoints for one season concurrently, keyed by endpoint"""
+    jobs = [(endpoint, {"year": year}) for endpoint in endpoints]
+    results, _ = fetch_many(jobs, **kwargs)
+    return dict(zip(endpoints, results))
@@ -0,0 +1,291 @@
+"""
+Small dependency-graph runner for the pipeline stages
+Each Stage names the stages whose results it takes as arguments, so
+stages that don't depend on each other (the CSV load and the OpenF1
+call, the database write and the plots) run at the same time on a thread
+or process pool instead of one after another
+
+A stage that declares output files is skipped when those files are still
+the ones it wrote last time and its sources and params haven't changed
+(saved in results/.pipeline_manifest/, like the plot manifest). Stages
+whose results nobody needs are skipped too, so a rerun with nothing
+changed costs almost nothing
+"""
+
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import instrumentation
+from instrumentation import count_rows, stage
+from workers import process_pool
+
+MANIFEST_DIR = Path("results") / ".pipeline_manifest"
+
+
+class Stage:
+    """
+    One step of the pipeline
+      func    - called with the results of `inputs` as arguments, in order
+      inputs  - names of the stages it needs
+      outputs - files it writes (without any, it always runs when needed)
+      sources - files it reads that aren't another stage's result
+      params  - settings that change its outputs (e.g. the years)
+      pool    - "thread", "process" (func must be picklable) or "main"
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), sources=(), params=None, pool="thread"):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = [Path(p) for p in outputs]
+        self.sources = [Path(p) for p in sources]
+        self.params = params or {}
+        self.pool = pool
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+
+def file_stats(paths):
+    """(size, mtime) of each file that exists, keyed by path"""
+    stats = {}
+    for path in paths:
+        if path.exists():
+            info = path.stat()
+            stats[str(path)] = [info.st_size, info.st_mtime_ns]
+    return stats
+
+
+def stage_fingerprint(stage):
+    """Hash of a stage's params and the size/mtime of its source files"""
+    h = hashlib.sha256()
+    h.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+    h.update(json.dumps(file_stats(stage.sources), sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def manifest_path(stage, manifest_dir=MANIFEST_DIR):
+    return Path(manifest_dir) / f"{stage.name}.json"
+
+
+def is_up_to_date(stage, manifest_dir=MANIFEST_DIR):
+    """True if the stage has outputs and they're exactly what its last run left"""
+    path = manifest_path(stage, manifest_dir)
+    if not stage.outputs or not path.exists():
+        return False
+    if not all(output.exists() for output in stage.outputs):
+        return False
+    saved = json.loads(path.read_text())
+    return (saved.get("fingerprint") == stage_fingerprint(stage)
+            and saved.get("outputs") == file_stats(stage.outputs))
+
+
+def save_manifest(stage, manifest_dir=MANIFEST_DIR):
+    """Remember what this run of the stage was based on and what it wrote"""
+    if not stage.outputs:
+        return
+    path = manifest_path(stage, manifest_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "fingerprint": stage_fingerprint(stage),
+        "params": stage.params,
+        "outputs": file_stats(stage.outputs),
+    }, default=str))
+
+
+def stage_rows(result, args):
+    """Rows for a stage's record: its result's, or its first input's if it returns none"""
+    rows = count_rows(result)
+    if rows is None and args:
+        rows = count_rows(args[0])
+    return rows
+
+
+def run_in_process(name, func, args):
+    """Run a stage in a worker process and send back its instrumentation records"""
+    instrumentation.reset()
+    with stage(name) as record:
+        result = func(*args)
+        record["rows"] = stage_rows(result, args)
+    return result, instrumentation.get_records()
+
+
+class Pipeline:
+    """A set of stages, run in dependency order"""
+
+    def __init__(self, stages, manifest_dir=MANIFEST_DIR):
+        self.stages = {s.name: s for s in stages}
+        self.manifest_dir = manifest_dir
+        for s in stages:
+            for name in s.inputs:
+                if name not in self.stages:
+                    raise ValueError(f"{s.name} needs unknown stage {name!r}")
+        self.order = self.topological_order()
+
+    def topological_order(self):
+        """Stage names with every stage after its inputs (ValueError on a cycle)"""
+        order = []
+        state = {}
+
+        def visit(name):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"stage {name!r} depends on itself")
+            state[name] = "visiting"
+            for dep in self.stages[name].inputs:
+                visit(dep)
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def consumers(self, name):
+        return [s.name for s in self.stages.values() if name in s.inputs]
+
+    def plan(self, only=None, skip=(), force=False):
+        """
+        Which stages to run
+        Targets are `only` (default: every stage) minus `skip`. A target
+        runs if it's out of date (or forced: force is True for every stage
+        or a list of stage names), or if it writes nothing and
+        either was asked for by name or nothing else uses its result.
+        Every input of a stage that runs runs too; a stage that needs a
+        skipped one is dropped
+        Returns (names to run in order, {name: reason} for the rest)
+        """
+        for name in list(only or []) + list(skip):
+            if name not in self.stages:
+                raise ValueError(f"unknown stage {name!r} (stages: {', '.join(self.order)})")
+        skip = set(skip)
+        forced = set(self.stages) if force is True else set(force or ())
+        targets = set(only) if only else set(self.stages)
+        targets -= skip
+
+        # Stages that can't run because something they need is skipped
+        reasons = {}
+        blocked = set(skip)
+        for name in self.order:
+            missing = [dep for dep in self.stages[name].inputs if dep in blocked]
+            if missing:
+                blocked.add(name)
+                if name in targets:
+                    reasons[name] = f"needs skipped stage {missing[0]}"
+
+        wanted = set()
+        for name in targets - blocked:
+            s = self.stages[name]
+            if s.outputs:
+                if name in forced or not is_up_to_date(s, self.manifest_dir):
+                    wanted.add(name)
+                else:
+                    reasons[name] = "up to date"
+            elif only or not self.consumers(name):
+                wanted.add(name)
+
+        # Pull in inputs, newest stages first so whole chains get added
+        to_run = set()
+        for name in reversed(self.order):
+            if name in wanted or any(c in to_run for c in self.consumers(name)):
+                to_run.add(name)
+                reasons.pop(name, None)
+        for name in self.order:
+            if name not in to_run and name not in reasons:
+                reasons[name] = "skipped" if name in skip else "not needed"
+        reasons = {name: reasons[name] for name in self.order if name in reasons}
+        return [name for name in self.order if name in to_run], reasons
+
+    def run(self, only=None, skip=(), force=False, concurrent=True, workers=None):
+        """
+        Run the planned stages, each as soon as its inputs are ready
+        With concurrent=False everything runs in this thread, in order
+        A failing stage is reported and the stages that need it don't run
+        Returns (results, failures): stage name -> result / error message
+        """
+        to_run, reasons = self.plan(only, skip, force)
+        for name, reason in reasons.items():
+            print(f"- {name}: {reason}")
+
+        results = {}
+        failures = {}
+        if not concurrent:
+            for name in to_run:
+                self.run_stage(name, results, failures)
+            return results, failures
+
+        if workers is None:
+            workers = max(len(to_run), 1)
+        n_process = sum(1 for name in to_run if self.stages[name].pool == "process")
+        pending = list(to_run)
+        running = {}
+        threads = ThreadPoolExecutor(max_workers=workers)
+        processes = None
+        try:
+            while pending or running:
+                for name in list(pending):
+                    s = self.stages[name]
+                    if any(dep in failures for dep in s.inputs):
+                        pending.remove(name)
+                        failures[name] = f"not run, {next(d for d in s.inputs if d in failures)} failed"
+                        print(f"✗ {name} {failures[name]}")
+                    elif all(dep in results for dep in s.inputs):
+                        pending.remove(name)
+                        if s.pool == "main":
+                            self.run_stage(name, results, failures)
+                            continue
+                        args = [results[dep] for dep in s.inputs]
+                        if s.pool == "process":
+                            if processes is None:
+                                # Spawned (see workers.py): the thread stages
+                                # are still running, so forking isn't safe
+                                processes = process_pool(min(workers, n_process))
+                            future = processes.submit(run_in_process, name, s.func, args)
+                        else:
+                            future = threads.submit(self.call_stage, s, args)
+                        running[future] = name
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                        if self.stages[name].pool == "process":
+                            result, records = result
+                            instrumentation.add_records(records)
+                        results[name] = result
+                        save_manifest(self.stages[name], self.manifest_dir)
+                    except Exception as e:
+                        failures[name] = f"{type(e).__name__}: {e}"
+                        print(f"✗ {name} failed: {failures[name]}")
+        finally:
+            threads.shutdown()
+            if processes is not None:
+                processes.shutdown()
+        return results, failures
+
+    def call_stage(self, s, args):
+        with stage(s.name) as record:
+            result = s.func(*args)
+            record["rows"] = stage_rows(result, args)
+        return result
+
+    def run_stage(self, name, results, failures):
+        """Run one stage in this thread, recording its result or error"""
+        s = self.stages[name]
+        missing = [dep for dep in s.inputs if dep not in results]
+        if missing:
+            failures[name] = f"not run, {missing[0]} failed"
+            print(f"✗ {name} {failures[name]}")
+            return
+        try:
+            results[name] = self.call_stage(s, [results[dep] for dep in s.inputs])
+            save_manifest(s, self.manifest_dir)
+        except Exception as e:
+            failures[name] = f"{type(e).__name__}: {e}"
+            print(f"✗ {name} failed: {failures[name]}")
@@ -0,0 +1,92 @@
+"""
+SQL queries over f1_analysis.db
+Team/driver/season aggregates are computed in SQLite (using the indexes
+from database.py) so notebooks don't need to load race_metrics first
+"""
+
+import sqlite3
+import pandas as pd
+
+from database import DB_FILE
+
+
+def connect_readonly(db_file=DB_FILE):
+    """Open the database read-only so queries can't change anything"""
+    return sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+
+
+def year_filter(years, prefix="WHERE"):
+    """Build a "year IN (?, ?)" clause and its parameters (empty if no years)"""
+    if not years:
+        return "", []
+    placeholders = ", ".join("?" * len(years))
+    return f"{prefix} year IN ({placeholders})", [int(y) for y in years]
+
+
+def run_query(sql, params=(), db_file=DB_FILE):
+    """Run a parameterized query and return the result as a DataFrame"""
+    conn = connect_readonly(db_file)
+    try:
+        return pd.read_sql_query(sql, conn, params=list(params))
+    finally:
+        conn.close()
+
+
+def team_pit_summary(years=None, db_file=DB_FILE):
+    """
+    Average pit stop time per team, fastest first
+    Same numbers as plot_pit_stops_by_team
+    """
+    where, params = year_filter(years, prefix="AND")
+    sql = f"""
+    SELECT team_name,
+           AVG(avg_pit_ms) AS avg_pit_ms,
+           COUNT(*) AS n_results
+    FROM race_metrics
+    WHERE avg_pit_ms IS NOT NULL {where}
+    GROUP BY team_name
+    ORDER BY avg_pit_ms
+    """
+    return run_query(sql, params, db_file)
+
+
+def driver_consistency(min_races=10, top_n=None, years=None, db_file=DB_FILE):
+    """
+    Average lap time variance per driver with at least min_races results,
+    most consistent first (same numbers as plot_lap_variance_by_driver)
+    """
+    where, params = year_filter(years)
+    sql = f"""
+    SELECT driver_name,
+           AVG(lap_var_ms) AS lap_var_ms,
+           COUNT(*) AS n_races
+    FROM race_metrics
+    {where}
+    GROUP BY driver_name
+    HAVING COUNT(*) >= ? AND AVG(lap_var_ms) IS NOT NULL
+    ORDER BY lap_var_ms
+    """
+    params.append(int(min_races))
+    if top_n is not None:
+        sql += "LIMIT ?"
+        params.append(int(top_n))
+    return run_query(sql, params, db_file)
+
+
+def season_overview(years=None, db_file=DB_FILE):
+    """One row per season with race/driver/team counts and average metrics"""
+    where, params = year_filter(years)
+    sql = f"""
+    SELECT year,
+           COUNT(DISTINCT raceId) AS total_races,
+           COUNT(DISTINCT driverId) AS total_drivers,
+           COUNT(DISTINCT team_name) AS total_teams,
+           AVG(avg_pit_ms) AS avg_pit_ms,
+           AVG(lap_var_ms) AS avg_lap_var_ms,
+           AVG(ABS(positions_gained)) AS avg_positions_changed
+    FROM race_metrics
+    {where}
+    GROUP BY year
+    ORDER BY year
+    """
+    return run_query(sql, params, db_file)
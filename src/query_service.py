@@ -0,0 +1,269 @@
+"""
+Local HTTP service for the processed race_metrics table
+Loads the table from f1_analysis.db once and keeps it in memory, so
+notebooks and dashboards can ask for the summary stats and the team/driver
+aggregates without re-running the pipeline or re-opening the database
+
+Endpoints (all GET, all return JSON):
+  /summary?years=2022,2023&min_races=10  - generate_summary_stats metrics
+  /teams?years=2023                      - average pit time per team
+  /drivers?years=2023&min_races=10&top_n=20 - lap time variance per driver
+  /health                                - rows loaded and cache hits/misses
+
+Answers are kept in an LRU cache keyed by (endpoint, years, min_races,
+top_n). The cache is cleared and the table reloaded as soon as the
+database changes (e.g. after python main.py rebuilds it)
+
+Usage: python src/query_service.py [--port 8765] [--socket PATH] [--db FILE]
+"""
+
+import argparse
+import json
+import math
+import os
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent))
+from analysis import compute_summary_stats, driver_lap_variance, team_pit_times
+from database import DB_FILE
+
+HOST = "127.0.0.1"
+PORT = 8765
+CACHE_SIZE = 256
+
+
+def clean_json(value):
+    """Turn NaN into None and numpy scalars into plain Python for json.dumps"""
+    if isinstance(value, dict):
+        return {key: clean_json(v) for key, v in value.items()}
+    if isinstance(value, list):
+        return [clean_json(v) for v in value]
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class MetricsStore:
+    """
+    race_metrics held in memory plus an LRU cache of encoded answers
+    Every request checks the database's identity (file inode + SQLite's
+    data_version, which changes whenever another connection commits), so
+    a rebuilt database is picked up without restarting the service
+    """
+
+    def __init__(self, db_file=DB_FILE, cache_size=CACHE_SIZE):
+        self.db_file = str(db_file)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.df = None
+        self.conn = None
+        self.conn_inode = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def current_version(self):
+        """(inode, data_version) of the database, or None if it doesn't exist"""
+        if not os.path.exists(self.db_file):
+            return None
+        inode = os.stat(self.db_file).st_ino
+        if self.conn is None or self.conn_inode != inode:
+            # A new file (deleted and recreated) needs a new connection
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = sqlite3.connect(
+                f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False
+            )
+            self.conn_inode = inode
+        return inode, self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self):
+        """Reload race_metrics and clear the cache if the database changed"""
+        version = self.current_version()
+        if version == self.version and self.df is not None:
+            return
+        if version is None:
+            self.df = None
+        else:
+            self.df = pd.read_sql_query("SELECT * FROM race_metrics", self.conn)
+            self.loads += 1
+        self.version = version
+        self.cache.clear()
+
+    def frame(self, years):
+        """race_metrics, limited to the given seasons"""
+        if not years:
+            return self.df
+        return self.df[self.df["year"].isin(years)]
+
+    def compute(self, endpoint, years, min_races, top_n):
+        """Answer one query from the in-memory table"""
+        df = self.frame(years)
+        if endpoint == "summary":
+            return compute_summary_stats(df, min_races)
+        if endpoint == "teams":
+            teams = team_pit_times(df)
+            return [{"team_name": name, "avg_pit_ms": value} for name, value in teams.items()]
+        if endpoint == "drivers":
+            n_races = df.groupby("driver_name").size()
+            drivers = driver_lap_variance(df, min_races, top_n)
+            return [
+                {"driver_name": name, "lap_var_ms": value, "n_races": n_races[name]}
+                for name, value in drivers.items()
+            ]
+        raise KeyError(endpoint)
+
+    def query(self, endpoint, years=(), min_races=10, top_n=None):
+        """
+        Encoded JSON answer for a query, from the cache when possible
+        Raises FileNotFoundError if the database hasn't been built yet
+        """
+        key = (endpoint, tuple(sorted(set(years))), min_races, top_n)
+        with self.lock:
+            self.refresh()
+            if self.df is None:
+                raise FileNotFoundError(f"{self.db_file} not found (run python main.py first)")
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+            self.misses += 1
+            result = self.compute(endpoint, key[1], min_races, top_n)
+            body = json.dumps(clean_json(result)).encode()
+            self.cache[key] = body
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return body
+
+    def health(self):
+        """Service status for the /health endpoint"""
+        with self.lock:
+            self.refresh()
+            return {
+                "db_file": self.db_file,
+                "rows": None if self.df is None else len(self.df),
+                "loads": self.loads,
+                "cached": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def parse_query(query_string):
+    """years, min_races and top_n from the URL query string"""
+    params = parse_qs(query_string)
+    years = []
+    for value in params.get("years", []):
+        years += [int(year) for year in value.split(",") if year]
+    min_races = int(params.get("min_races", ["10"])[0])
+    top_n = params.get("top_n", [None])[0]
+    top_n = int(top_n) if top_n is not None else None
+    return years, min_races, top_n
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Routes GET requests to the MetricsStore on self.server.store"""
+
+    ENDPOINTS = ("summary", "teams", "drivers")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip("/")
+        store = self.server.store
+        try:
+            if endpoint == "health":
+                body = json.dumps(store.health()).encode()
+            elif endpoint in self.ENDPOINTS:
+                years, min_races, top_n = parse_query(url.query)
+                body = store.query(endpoint, years, min_races, top_n)
+            else:
+                return self.send_json(404, {"error": f"unknown endpoint /{endpoint}"})
+        except ValueError as e:
+            return self.send_json(400, {"error": f"bad parameter: {e}"})
+        except FileNotFoundError as e:
+            return self.send_json(503, {"error": str(e)})
+        except Exception as e:
+            # e.g. the table is being rebuilt right now; the next request retries
+            return self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        self.send_body(200, body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode())
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # Dashboards poll a lot; keep the console quiet
+        pass
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    """Same server listening on a Unix domain socket instead of a TCP port"""
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_server(db_file=DB_FILE, host=HOST, port=PORT, socket_path=None, cache_size=CACHE_SIZE):
+    """Create (but don't start) the server; port=0 picks a free port"""
+    if socket_path is not None:
+        server = UnixHTTPServer(str(socket_path), QueryHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.store = MetricsStore(db_file, cache_size)
+    return server
+
+
+def main(argv=None):
+    """Run the service until Ctrl+C"""
+    parser = argparse.ArgumentParser(description="Serve F1 race_metrics queries as JSON")
+    parser.add_argument("--db", default=DB_FILE, help=f"database file (default {DB_FILE})")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--socket", help="listen on this Unix socket instead of a TCP port")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.db, args.host, args.port, args.socket)
+    where = args.socket or f"http://{args.host}:{server.server_port}"
+    print(f"✓ Serving {args.db} on {where} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
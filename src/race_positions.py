@@ -0,0 +1,232 @@
+"""
+Lap-by-lap race positions rebuilt from lap_times
+calculate_positions_gained only compares the grid with the finish; this
+puts every driver's position and cumulative race time on every lap into
+dense (race x lap x driver) NumPy arrays, so gaps to the leader, gaps to
+the car ahead, overtakes and laps led are whole-array operations instead
+of per-row pandas loops
+
+Each race gets driver slots 0..n-1 (its drivers in driverId order) and
+lap index 0 is lap 1. Cells for laps a driver didn't complete have
+position 0 and NaN times
+"""
+
+import importlib
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from lap_features import contains, group_starts
+
+data_preprocessing = importlib.import_module("data preprocessing")
+race_driver_keys = data_preprocessing.race_driver_keys
+
+OVERTAKE_CHUNK = 256  # races per chunk when comparing every pair of drivers
+
+
+class RacePositions:
+    """
+    Position and timing arrays for a set of races, indexed by (raceId, lap)
+      race_ids    (races,)                sorted raceIds
+      driver_ids  (races, drivers)        driverId in each slot, -1 if unused
+      n_laps      (races,)                laps in the race (the winner's)
+      position    (races, laps, drivers)  int16, 0 = not on track
+      cum_ms      (races, laps, drivers)  race time at the end of the lap
+      pitting     (races, laps, drivers)  in-lap or out-lap (None without pit data)
+    gap_to_leader_ms, interval_ms and overtakes are worked out on first use
+    """
+
+    def __init__(self, race_ids, driver_ids, position, cum_ms, pitting=None):
+        self.race_ids = race_ids
+        self.driver_ids = driver_ids
+        self.position = position
+        self.cum_ms = cum_ms
+        self.pitting = pitting
+        self.n_laps = (position > 0).any(axis=2).sum(axis=1)
+        self._gap = None
+        self._interval = None
+        self._passes = None
+
+    def __len__(self):
+        return len(self.race_ids)
+
+    def race_index(self, race_id):
+        """Row of a raceId in the arrays (KeyError if it isn't there)"""
+        i = np.searchsorted(self.race_ids, race_id)
+        if i >= len(self.race_ids) or self.race_ids[i] != race_id:
+            raise KeyError(race_id)
+        return i
+
+    @property
+    def on_track(self):
+        return self.position > 0
+
+    @property
+    def gap_to_leader_ms(self):
+        """Time behind the car that led the lap, when crossing the line"""
+        if self._gap is None:
+            # fmin skips NaN without warning about laps where every time is missing
+            leader = np.fmin.reduce(np.where(self.on_track, self.cum_ms, np.inf), axis=2)
+            self._gap = np.where(self.on_track, self.cum_ms - leader[:, :, None], np.nan)
+        return self._gap
+
+    @property
+    def interval_ms(self):
+        """Time behind the car one place ahead (NaN for the leader)"""
+        if self._interval is None:
+            # Sort each lap's slots by position, diff, and put the gaps back
+            order = np.argsort(np.where(self.on_track, self.position, np.iinfo(np.int16).max), axis=2)
+            by_position = np.take_along_axis(self.cum_ms, order, axis=2)
+            gaps = np.full(by_position.shape, np.nan)
+            gaps[:, :, 1:] = by_position[:, :, 1:] - by_position[:, :, :-1]
+            interval = np.empty_like(gaps)
+            np.put_along_axis(interval, order, gaps, axis=2)
+            self._interval = np.where(self.on_track, interval, np.nan)
+        return self._interval
+
+    @property
+    def passes(self):
+        """Cars each driver got past on each lap (int16, 0 on lap 1)"""
+        if self._passes is None:
+            self._passes = count_passes(self.position, self.pitting)
+        return self._passes
+
+    def overtakes_per_lap(self):
+        """(races, laps) total overtakes on each lap"""
+        return self.passes.sum(axis=2)
+
+    def laps_led(self):
+        """(races, drivers) laps completed in first place"""
+        return (self.position == 1).sum(axis=1)
+
+    def lap(self, race_id, lap):
+        """One lap of one race as a DataFrame in running order"""
+        i = self.race_index(race_id)
+        j = lap - 1
+        if not 0 <= j < self.position.shape[1]:
+            raise KeyError((race_id, lap))
+        slots = np.flatnonzero(self.on_track[i, j])
+        frame = pd.DataFrame({
+            "driverId": self.driver_ids[i, slots],
+            "position": self.position[i, j, slots],
+            "cum_ms": self.cum_ms[i, j, slots],
+            "gap_to_leader_ms": self.gap_to_leader_ms[i, j, slots],
+            "interval_ms": self.interval_ms[i, j, slots],
+            "passes": self.passes[i, j, slots],
+        })
+        return frame.sort_values("position").reset_index(drop=True)
+
+    def lap_table(self):
+        """
+        One row per (raceId, lap) with the leader, the cars still running,
+        the overtakes and the gap from first to second
+        """
+        races, laps = np.nonzero(self.on_track.any(axis=2))
+        leader_slot = np.argmax(self.position[races, laps] == 1, axis=1)
+        is_second = self.position[races, laps] == 2
+        lead_gap = np.where(is_second, self.gap_to_leader_ms[races, laps], 0).sum(axis=1)
+        table = pd.DataFrame({
+            "raceId": self.race_ids[races],
+            "lap": (laps + 1).astype(np.int16),
+            "leader_driverId": self.driver_ids[races, leader_slot],
+            "cars": self.on_track[races, laps].sum(axis=1),
+            "overtakes": self.overtakes_per_lap()[races, laps],
+            "lead_gap_ms": np.where(is_second.any(axis=1), lead_gap, np.nan),
+        })
+        return table.set_index(["raceId", "lap"])
+
+    def driver_table(self):
+        """
+        One row per (raceId, driverId) with laps led, overtakes made, the
+        average gap to the leader and the best position held
+        """
+        races, slots = np.nonzero(self.driver_ids >= 0)
+        position = np.where(self.on_track, self.position, np.iinfo(np.int16).max)
+        gap = self.gap_to_leader_ms
+        timed = ~np.isnan(gap)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_gap = np.where(timed, gap, 0).sum(axis=1) / timed.sum(axis=1)
+        best = position.min(axis=1)
+        return pd.DataFrame({
+            "raceId": self.race_ids[races],
+            "driverId": self.driver_ids[races, slots],
+            "laps_completed": self.on_track.sum(axis=1)[races, slots],
+            "laps_led": self.laps_led()[races, slots],
+            "overtakes": self.passes.sum(axis=1)[races, slots],
+            "best_position": np.where(best == np.iinfo(np.int16).max, 0, best)[races, slots],
+            "mean_gap_to_leader_ms": mean_gap[races, slots],
+        })
+
+
+def count_passes(position, pitting=None, chunk=OVERTAKE_CHUNK):
+    """
+    Cars each driver got past on each lap: driver a passes b on lap L if
+    a was behind b at the end of lap L-1 and ahead of b at the end of L,
+    with both cars running on both laps (so cars retiring don't count)
+    and, if pitting is given, neither on an in-lap or out-lap on lap L
+    (so places swapped in the pit stops don't count either)
+    Compares every pair of drivers, a chunk of races at a time
+    """
+    passes = np.zeros(position.shape, dtype=np.int16)
+    for start in range(0, position.shape[0], chunk):
+        pos = position[start:start + chunk].astype(np.int16)
+        before, after = pos[:, :-1], pos[:, 1:]
+        running = (before > 0) & (after > 0)
+        if pitting is not None:
+            running &= ~pitting[start:start + chunk, 1:]
+        # [race, lap, a, b]: a behind b before and ahead of b after
+        was_behind = before[:, :, :, None] > before[:, :, None, :]
+        now_ahead = after[:, :, :, None] < after[:, :, None, :]
+        both = running[:, :, :, None] & running[:, :, None, :]
+        passes[start:start + chunk, 1:] = (was_behind & now_ahead & both).sum(axis=3)
+    return passes
+
+
+@instrumented()
+def build_race_positions(lap_times_df, pit_stops_df=None):
+    """
+    Build RacePositions from lap_times (raceId, driverId, lap, position,
+    milliseconds), in any row order
+    With pit_stops_df, passes on in-laps and out-laps aren't overtakes
+    """
+    race = lap_times_df["raceId"].to_numpy(dtype=np.int64)
+    lap = lap_times_df["lap"].to_numpy(dtype=np.int64)
+    if len(race) == 0:
+        empty = np.zeros((0, 0, 0))
+        return RacePositions(np.array([], dtype=np.int32), np.zeros((0, 0), dtype=np.int32),
+                             empty.astype(np.int16), empty)
+
+    # Race row and driver slot of every lap
+    race_ids, race_row = np.unique(race, return_inverse=True)
+    pairs, pair_row = np.unique(race_driver_keys(lap_times_df), return_inverse=True)
+    pair_starts, _ = group_starts(pairs >> 32)
+    pair_slot = np.arange(len(pairs)) - pair_starts
+    slot = pair_slot[pair_row]
+
+    n_races, n_laps, n_slots = len(race_ids), int(lap.max()), int(pair_slot.max()) + 1
+    driver_ids = np.full((n_races, n_slots), -1, dtype=np.int32)
+    driver_ids[np.searchsorted(race_ids, pairs >> 32), pair_slot] = pairs & 0xFFFFFFFF
+
+    position = np.zeros((n_races, n_laps, n_slots), dtype=np.int16)
+    position[race_row, lap - 1, slot] = lap_times_df["position"].to_numpy()
+    lap_ms = np.full((n_races, n_laps, n_slots), np.nan)
+    lap_ms[race_row, lap - 1, slot] = lap_times_df["milliseconds"].to_numpy()
+    # A missing lap leaves the rest of that driver's race NaN rather than wrong
+    cum_ms = np.cumsum(lap_ms, axis=1)
+
+    pitting = None
+    if pit_stops_df is not None:
+        # A stop on lap L makes L the in-lap and L + 1 the out-lap
+        pit_pairs = race_driver_keys(pit_stops_df)
+        pit_lap = pit_stops_df["lap"].to_numpy(dtype=np.int64)
+        known = contains(pairs, pit_pairs) & (pit_lap >= 1) & (pit_lap <= n_laps)
+        pit_pairs, pit_lap = pit_pairs[known], pit_lap[known]
+        pit_race = np.searchsorted(race_ids, pit_pairs >> 32)
+        pit_slot = pair_slot[np.searchsorted(pairs, pit_pairs)]
+        pitting = np.zeros(position.shape, dtype=bool)
+        pitting[pit_race, pit_lap - 1, pit_slot] = True
+        out = pit_lap < n_laps
+        pitting[pit_race[out], pit_lap[out], pit_slot[out]] = True
+
+    return RacePositions(race_ids.astype(np.int32), driver_ids, position, cum_ms, pitting)
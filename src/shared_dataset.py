@@ -0,0 +1,85 @@
+"""
+Share the merged race_metrics frame between processes through one file
+merge_all_data(..., publish_path=...) writes it as an uncompressed Arrow
+IPC (Feather v2) file; load_shared() memory-maps that file, so numeric
+columns are read-only views of the OS page cache instead of private
+copies. Any number of plot workers, notebooks or scripts can open it and
+the data is only held in memory once
+
+Needs pyarrow (optional, like the CSV cache in load_data.py)
+"""
+
+import os
+from pathlib import Path
+
+from load_data import has_pyarrow
+
+SHARED_FILE = Path("f1_race_metrics.arrow")
+
+
+def to_arrow(df):
+    """
+    Arrow table for df, keeping NaN in float columns as NaN
+    (pyarrow would normally turn NaN into nulls, and a column with nulls
+    has to be copied when it's read back into pandas)
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, (name, dtype) in enumerate(df.dtypes.items()):
+        if dtype.kind == "f":
+            table = table.set_column(i, name, pa.array(df[name].to_numpy(), from_pandas=False))
+    return table
+
+
+def publish(df, path=SHARED_FILE):
+    """
+    Write df as an uncompressed Arrow IPC file (compressed buffers can't be
+    memory-mapped). The file is replaced atomically, so processes that
+    already have the old one mapped keep reading the old version
+    Returns the path, or None without pyarrow
+    """
+    if not has_pyarrow():
+        print("✗ pyarrow is not installed, can't publish the shared dataset")
+        return None
+    import pyarrow as pa
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = to_arrow(df)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    print(f"✓ Published {len(df)} rows to {path}")
+    return path
+
+
+def open_shared_table(path=SHARED_FILE, columns=None):
+    """Memory-mapped Arrow table (no data is read until it's used)"""
+    import pyarrow as pa
+
+    source = pa.memory_map(str(path), "r")
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(list(columns))
+    return table
+
+
+def load_shared(path=SHARED_FILE, columns=None):
+    """
+    pandas DataFrame backed by the memory-mapped file
+    Numeric columns without nulls are zero-copy, read-only views; text
+    and nullable integer columns are converted (and so copied)
+    Returns None if the file or pyarrow is missing
+    """
+    if not has_pyarrow():
+        print("✗ pyarrow is not installed, can't load the shared dataset")
+        return None
+    if not Path(path).exists():
+        print(f"✗ Error: {path} not found (run merge_all_data with publish_path first)")
+        return None
+    # split_blocks keeps one block per column, so pandas doesn't copy the
+    # columns into a combined 2D array
+    return open_shared_table(path, columns).to_pandas(split_blocks=True)
@@ -0,0 +1,206 @@
+"""
+Pit stop strategy: did a stop gain or lose track position?
+calculate_avg_pit_time only keeps the mean stop duration. This compares
+every stop with the cars around it: each rival within GAP_WINDOW_MS on
+track is measured from the lap before the first of the two stops to the
+lap after the last one, so undercuts (we stopped first), overcuts (we
+stayed out longer) and stops against cars that didn't stop all show up
+as places and milliseconds won or lost
+
+Lookups go through LapIndex, lap_times sorted by (raceId, lap, driverId)
+packed into one int64, so finding a car on a lap, or every car on a lap,
+is a searchsorted instead of a merge or a loop
+"""
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from lap_features import group_starts, grouped_cumsum, lap_keys
+
+GAP_WINDOW_MS = 5000  # rivals within this gap (either way) before the stops
+STOP_WINDOW = 3  # laps; a rival stopping this close to us is the same exchange
+
+
+def index_keys(race, lap, driver):
+    """Pack (raceId, lap, driverId) into one sortable int64"""
+    return (race.astype(np.int64) << 32) | (lap.astype(np.int64) << 16) | driver.astype(np.int64)
+
+
+class LapIndex:
+    """
+    Position and cumulative race time of every car on every lap, sorted
+    by (raceId, lap, driverId)
+    """
+
+    def __init__(self, keys, position, cum_ms):
+        self.keys = keys
+        self.position = position
+        self.cum_ms = cum_ms
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, race, lap, driver):
+        """Rows for each (race, lap, driver) and whether it was found"""
+        wanted = index_keys(race, lap, driver)
+        rows = np.minimum(np.searchsorted(self.keys, wanted), max(len(self.keys) - 1, 0))
+        found = len(self.keys) > 0 and self.keys[rows] == wanted
+        return rows, np.asarray(found, dtype=bool) & (np.asarray(lap) >= 1)
+
+    def lap_rows(self, race, lap):
+        """First and one-past-last row of each (race, lap): every car on that lap"""
+        start = np.searchsorted(self.keys, index_keys(race, lap, np.zeros_like(lap)))
+        end = np.searchsorted(self.keys, index_keys(race, lap + 1, np.zeros_like(lap)))
+        return start, end
+
+
+@instrumented(rows_arg="lap_times_df")
+def build_lap_index(lap_times_df):
+    """LapIndex from lap_times (raceId, driverId, lap, position, milliseconds)"""
+    race = lap_times_df["raceId"].to_numpy(dtype=np.int64)
+    driver = lap_times_df["driverId"].to_numpy(dtype=np.int64)
+    lap = lap_times_df["lap"].to_numpy(dtype=np.int64)
+    lap_ms = lap_times_df["milliseconds"].to_numpy(dtype=np.float64)
+
+    # Cumulative time runs along each driver's race...
+    by_driver = np.argsort(lap_keys(race, driver, lap), kind="stable")
+    starts, _ = group_starts((race[by_driver] << 32) | driver[by_driver])
+    cum_ms = np.empty(len(lap_ms))
+    cum_ms[by_driver] = grouped_cumsum(lap_ms[by_driver], starts)
+
+    # ...but lookups want every car on a lap next to each other
+    keys = index_keys(race, lap, driver)
+    order = np.argsort(keys, kind="stable")
+    position = lap_times_df["position"].to_numpy()[order]
+    return LapIndex(keys[order], position, cum_ms[order])
+
+
+def expand_lap(index, race, lap):
+    """
+    Every car on each (race, lap): returns (which input row, index row)
+    pairs, built with np.repeat instead of a loop
+    """
+    start, end = index.lap_rows(race, lap)
+    counts = end - start
+    owner = np.repeat(np.arange(len(race)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(start, counts) + offsets
+
+
+def nearest_stops(pit_keys, pit_lap, race, driver, lap, window):
+    """
+    Lap of each driver's first stop within `window` laps of `lap`
+    (0 where there isn't one); pit_keys must be sorted lap_keys
+    """
+    if len(pit_keys) == 0:
+        return np.zeros(len(race), dtype=np.int64)
+    first = lap_keys(race, driver, np.maximum(lap - window, 0))
+    i = np.minimum(np.searchsorted(pit_keys, first), len(pit_keys) - 1)
+    same_car = (pit_keys[i] >> 16) == (first >> 16)
+    in_window = same_car & (pit_keys[i] >= first) & (pit_lap[i] <= lap + window)
+    return np.where(in_window, pit_lap[i], 0)
+
+
+@instrumented()
+def stop_rival_pairs(lap_times_df, pit_stops_df, gap_window_ms=GAP_WINDOW_MS,
+                     stop_window=STOP_WINDOW, index=None):
+    """
+    One row per (pit stop, nearby rival):
+      rival_stop_lap - the rival's stop within stop_window laps (0 if none)
+      kind           - "undercut" (we stopped first), "overcut" (rival
+                       first), "same_lap" or "no_stop" (rival stayed out)
+      before_lap, after_lap - lap before the first stop, lap after the last
+      gap_before_ms, gap_after_ms - our time minus the rival's (positive
+                       = behind) at those laps
+      time_gained_ms - gap_before_ms - gap_after_ms
+      places_gained  - +1 if we got ahead, -1 if the rival did, else 0
+    index can be a LapIndex already built from lap_times_df
+    """
+    if index is None:
+        index = build_lap_index(lap_times_df)
+
+    race = pit_stops_df["raceId"].to_numpy(dtype=np.int64)
+    driver = pit_stops_df["driverId"].to_numpy(dtype=np.int64)
+    lap = pit_stops_df["lap"].to_numpy(dtype=np.int64)
+    pit_keys = lap_keys(race, driver, lap)
+    pit_order = np.argsort(pit_keys, kind="stable")
+    pit_keys, pit_lap = pit_keys[pit_order], lap[pit_order]
+
+    # Candidate rivals: everyone else still running on our in-lap
+    stop_row, rival_row = expand_lap(index, race, lap)
+    rival = index.keys[rival_row] & 0xFFFF
+    keep = rival != driver[stop_row]
+    stop_row, rival = stop_row[keep], rival[keep]
+    r_race, r_driver, r_lap = race[stop_row], driver[stop_row], lap[stop_row]
+
+    rival_stop = nearest_stops(pit_keys, pit_lap, r_race, rival, r_lap, stop_window)
+    other = np.where(rival_stop > 0, rival_stop, r_lap)
+    before_lap = np.minimum(r_lap, other) - 1
+    after_lap = np.maximum(r_lap, other) + 1
+
+    rows = {}
+    found = np.ones(len(stop_row), dtype=bool)
+    for name, car, at in [("us_before", r_driver, before_lap), ("us_after", r_driver, after_lap),
+                          ("them_before", rival, before_lap), ("them_after", rival, after_lap)]:
+        rows[name], ok = index.find(r_race, at, car)
+        found &= ok
+
+    gap_before = index.cum_ms[rows["us_before"]] - index.cum_ms[rows["them_before"]]
+    gap_after = index.cum_ms[rows["us_after"]] - index.cum_ms[rows["them_after"]]
+    close = found & (np.abs(gap_before) <= gap_window_ms)
+
+    was_ahead = index.position[rows["us_before"]] < index.position[rows["them_before"]]
+    now_ahead = index.position[rows["us_after"]] < index.position[rows["them_after"]]
+    kind = np.select(
+        [rival_stop == 0, rival_stop > r_lap, rival_stop < r_lap],
+        ["no_stop", "undercut", "overcut"],
+        default="same_lap",
+    )
+
+    pairs = pd.DataFrame({
+        "raceId": r_race.astype(np.int32),
+        "driverId": r_driver.astype(np.int32),
+        "lap": r_lap.astype(np.int16),
+        "rival_driverId": rival.astype(np.int32),
+        "rival_stop_lap": rival_stop.astype(np.int16),
+        "kind": kind,
+        "before_lap": before_lap.astype(np.int16),
+        "after_lap": after_lap.astype(np.int16),
+        "gap_before_ms": gap_before,
+        "gap_after_ms": gap_after,
+        "time_gained_ms": gap_before - gap_after,
+        "places_gained": now_ahead.astype(np.int8) - was_ahead.astype(np.int8),
+    })
+    return pairs[close].reset_index(drop=True)
+
+
+def stop_summary(pairs, pit_stops_df):
+    """
+    pit_stops with, per stop, the rivals it was measured against, the net
+    places gained on them and the mean time gained (NaN with no rivals)
+    """
+    per_stop = pairs.groupby(["raceId", "driverId", "lap"]).agg(
+        rivals=("rival_driverId", "size"),
+        places_gained=("places_gained", "sum"),
+        mean_time_gained_ms=("time_gained_ms", "mean"),
+    ).reset_index()
+    stops = pit_stops_df.merge(per_stop, on=["raceId", "driverId", "lap"], how="left")
+    stops["rivals"] = stops["rivals"].fillna(0).astype(int)
+    stops["places_gained"] = stops["places_gained"].fillna(0).astype(int)
+    return stops
+
+
+def undercut_summary(pairs):
+    """
+    How often each kind of exchange worked: attempts are pairs where we
+    started behind the rival, successes the ones where we came out ahead
+    """
+    behind = pairs[pairs["gap_before_ms"] > 0]
+    summary = behind.groupby("kind").agg(
+        attempts=("places_gained", "size"),
+        successes=("places_gained", lambda gained: int((gained > 0).sum())),
+        mean_time_gained_ms=("time_gained_ms", "mean"),
+    )
+    summary["success_rate"] = summary["successes"] / summary["attempts"]
+    return summary
@@ -0,0 +1,242 @@
+"""
+Synthetic F1 data with the same files and columns as the Kaggle dataset
+Used by the tests and benchmarks so they don't need the real CSVs
+Lap times, pit stops, positions and results are consistent with each other
+(positions come from cumulative race time), so every pipeline stage works
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+N_TEAMS = 10
+DRIVERS_PER_TEAM = 2
+RACES_PER_SEASON = 22
+BASE_LAPS = 58
+
+
+def format_lap_time(ms):
+    """90123 -> '1:30.123' like the Kaggle lap time columns"""
+    ms = np.asarray(ms, dtype=np.int64)
+    minutes = ms // 60000
+    seconds = (ms % 60000) / 1000
+    return [f"{m}:{s:06.3f}" for m, s in zip(minutes, seconds)]
+
+
+def make_drivers(n_drivers):
+    """drivers.csv"""
+    ids = np.arange(1, n_drivers + 1)
+    return pd.DataFrame({
+        "driverId": ids,
+        "driverRef": [f"driver_{i}" for i in ids],
+        "number": ids,
+        "code": [f"D{i:02d}" for i in ids],
+        "forename": [f"Driver{i}" for i in ids],
+        "surname": [f"Surname{i}" for i in ids],
+        "dob": "1995-01-01",
+        "nationality": "Synthetic",
+        "url": "\\N",
+    })
+
+
+def make_constructors(n_teams):
+    """constructors.csv"""
+    ids = np.arange(1, n_teams + 1)
+    return pd.DataFrame({
+        "constructorId": ids,
+        "constructorRef": [f"team_{i}" for i in ids],
+        "name": [f"Team {i}" for i in ids],
+        "nationality": "Synthetic",
+        "url": "\\N",
+    })
+
+
+def simulate_race(rng, race_id, driver_ids, team_ids, skill, pit_speed):
+    """
+    Lap-by-lap simulation of one race
+    Returns (laps, pit_stops, results) as dicts of column arrays
+    """
+    n = len(driver_ids)
+    n_laps = BASE_LAPS + int(rng.integers(-8, 9))
+    base_ms = rng.uniform(75000, 105000)
+
+    # Each driver stops once or twice; a few retire early
+    n_stops = rng.integers(1, 3, size=n)
+    laps_done = np.full(n, n_laps)
+    retired = rng.random(n) < 0.08
+    laps_done[retired] = rng.integers(1, n_laps, size=retired.sum())
+
+    lap_no = np.arange(1, n_laps + 1)
+    # Stint boundaries: stops spread over the race with some jitter
+    stop_laps = np.zeros((n, 2), dtype=np.int64)
+    for k in range(2):
+        target = (k + 1) * n_laps // (n_stops + 1)
+        stop_laps[:, k] = np.clip(target + rng.integers(-3, 4, size=n), 2, n_laps - 2)
+    stop_laps[n_stops == 1, 1] = 0
+
+    # Tyre age resets after every stop (laps since the last stop)
+    last_stop = np.zeros((n, n_laps), dtype=np.int64)
+    for k in range(2):
+        lap_matrix = np.broadcast_to(lap_no, (n, n_laps))
+        passed = (stop_laps[:, [k]] > 0) & (lap_matrix > stop_laps[:, [k]])
+        last_stop = np.where(passed, stop_laps[:, [k]], last_stop)
+    tyre_age = lap_no - last_stop
+
+    lap_ms = (
+        base_ms
+        + skill[:, None]
+        + 60.0 * tyre_age
+        + rng.normal(0, 400, size=(n, n_laps))
+    )
+    lap_ms[:, 0] += 6000  # standing start
+
+    # Safety car: a few slow laps for everyone
+    if rng.random() < 0.3:
+        sc_start = int(rng.integers(5, n_laps - 5))
+        lap_ms[:, sc_start:sc_start + 3] += 25000
+
+    # Pit stop duration (stationary + pit lane) goes on the in-lap
+    stop_ms = np.zeros((n, 2))
+    for k in range(2):
+        has_stop = stop_laps[:, k] > 0
+        stop_ms[has_stop, k] = rng.normal(22000 + pit_speed[has_stop], 900)
+        slow = has_stop & (rng.random(n) < 0.02)
+        stop_ms[slow, k] += rng.uniform(5000, 30000, size=slow.sum())
+        rows = np.flatnonzero(has_stop)
+        lap_ms[rows, stop_laps[rows, k] - 1] += stop_ms[rows, k]
+    lap_ms = np.round(lap_ms).astype(np.int64)
+
+    # Positions from cumulative time; retired drivers drop behind
+    running = lap_no[None, :] <= laps_done[:, None]
+    cumulative = np.cumsum(lap_ms, axis=1).astype(np.float64)
+    ranking_time = np.where(running, cumulative, np.inf)
+    order = np.argsort(ranking_time, axis=0, kind="stable")
+    positions = np.empty_like(order)
+    positions[order, np.arange(n_laps)] = np.arange(1, n + 1)[:, None]
+
+    driver_idx, lap_idx = np.nonzero(running)
+    laps = {
+        "raceId": np.full(len(driver_idx), race_id),
+        "driverId": driver_ids[driver_idx],
+        "lap": lap_idx + 1,
+        "position": positions[driver_idx, lap_idx],
+        "milliseconds": lap_ms[driver_idx, lap_idx],
+    }
+
+    stop_driver, stop_k = np.nonzero(
+        (stop_laps > 0) & (stop_laps <= laps_done[:, None])
+    )
+    pits = {
+        "raceId": np.full(len(stop_driver), race_id),
+        "driverId": driver_ids[stop_driver],
+        "stop": stop_k + 1,
+        "lap": stop_laps[stop_driver, stop_k],
+        "milliseconds": np.round(stop_ms[stop_driver, stop_k]).astype(np.int64),
+    }
+
+    # Final classification: most laps first, then total time
+    total = np.where(running, lap_ms, 0).sum(axis=1)
+    finish_order = np.lexsort((total, -laps_done))
+    position_order = np.empty(n, dtype=np.int64)
+    position_order[finish_order] = np.arange(1, n + 1)
+    grid = np.argsort(np.argsort(skill + rng.normal(0, 300, size=n))) + 1
+
+    results = {
+        "raceId": np.full(n, race_id),
+        "driverId": driver_ids,
+        "constructorId": team_ids,
+        "grid": grid,
+        "positionOrder": position_order,
+        "laps": laps_done,
+        "milliseconds": total,
+        "retired": retired,
+    }
+    return laps, pits, results
+
+
+def generate_tables(seasons=3, start_year=2022, races_per_season=RACES_PER_SEASON, seed=0):
+    """
+    Build all six Kaggle tables for `seasons` seasons of synthetic racing
+    Returns a dict like load_all_kaggle_data()
+    """
+    rng = np.random.default_rng(seed)
+    n_drivers = N_TEAMS * DRIVERS_PER_TEAM
+    driver_ids = np.arange(1, n_drivers + 1)
+    team_ids = (driver_ids - 1) // DRIVERS_PER_TEAM + 1
+    skill = rng.normal(0, 600, size=n_drivers)
+    pit_speed = rng.normal(0, 800, size=N_TEAMS)[team_ids - 1]
+
+    races, laps, pits, results = [], [], [], []
+    race_id = 0
+    for year in range(start_year, start_year + seasons):
+        for rnd in range(1, races_per_season + 1):
+            race_id += 1
+            races.append({
+                "raceId": race_id,
+                "year": year,
+                "round": rnd,
+                "circuitId": rnd,
+                "name": f"Grand Prix {rnd}",
+                "date": f"{year}-{3 + (rnd - 1) * 9 // races_per_season:02d}-{1 + rnd % 28:02d}",
+                "time": "\\N",
+                "url": "\\N",
+            })
+            race_laps, race_pits, race_results = simulate_race(
+                rng, race_id, driver_ids, team_ids, skill, pit_speed
+            )
+            laps.append(race_laps)
+            pits.append(race_pits)
+            results.append(race_results)
+
+    laps = {col: np.concatenate([r[col] for r in laps]) for col in laps[0]}
+    pits = {col: np.concatenate([r[col] for r in pits]) for col in pits[0]}
+    results = {col: np.concatenate([r[col] for r in results]) for col in results[0]}
+
+    lap_times = pd.DataFrame(laps)
+    lap_times.insert(4, "time", format_lap_time(lap_times["milliseconds"]))
+
+    pit_stops = pd.DataFrame(pits)
+    pit_stops.insert(4, "time", "14:00:00")
+    pit_stops.insert(5, "duration", [f"{ms / 1000:.3f}" for ms in pit_stops["milliseconds"]])
+
+    points_table = np.array([25, 18, 15, 12, 10, 8, 6, 4, 2, 1] + [0] * n_drivers)
+    finished = ~results["retired"]
+    results_df = pd.DataFrame({
+        "resultId": np.arange(1, len(results["raceId"]) + 1),
+        "raceId": results["raceId"],
+        "driverId": results["driverId"],
+        "constructorId": results["constructorId"],
+        "number": results["driverId"],
+        "grid": results["grid"],
+        "position": np.where(finished, results["positionOrder"].astype(str), "\\N"),
+        "positionText": np.where(finished, results["positionOrder"].astype(str), "R"),
+        "positionOrder": results["positionOrder"],
+        "points": points_table[results["positionOrder"] - 1].astype(float),
+        "laps": results["laps"],
+        "time": "\\N",
+        "milliseconds": np.where(finished, results["milliseconds"].astype(str), "\\N"),
+        "fastestLap": "\\N",
+        "rank": "\\N",
+        "fastestLapTime": "\\N",
+        "fastestLapSpeed": "\\N",
+        "statusId": np.where(finished, 1, 5),
+    })
+
+    return {
+        "races": pd.DataFrame(races),
+        "results": results_df,
+        "pit_stops": pit_stops,
+        "lap_times": lap_times,
+        "drivers": make_drivers(n_drivers),
+        "constructors": make_constructors(N_TEAMS),
+    }
+
+
+def write_csvs(data, data_dir):
+    """Write the tables as <name>.csv files into data_dir"""
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in data.items():
+        df.to_csv(data_dir / f"{name}.csv", index=False)
+    return data_dir
@@ -0,0 +1,29 @@
+"""
+Process pools for the parallel code paths (plots, race metrics, CSV
+loading, bootstrap)
+Workers are started with spawn, not fork: the pipeline runs stages on
+threads, and a child forked while another thread holds a lock (e.g. in
+the middle of the database write) can hang for good
+Spawned workers re-import the script that was run, so a script using
+them needs an `if __name__ == "__main__":` guard around its own work.
+Code piped in on stdin can't be re-imported at all; can_spawn() is False
+there and the callers fall back to running in one process
+"""
+
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+def can_spawn():
+    """True unless __main__ is a file that spawned workers couldn't re-import (e.g. <stdin>)"""
+    path = getattr(sys.modules.get("__main__"), "__file__", None)
+    # Without a __file__ (python -c, notebooks) workers don't import __main__
+    return path is None or Path(path).is_file()
+
+
+def process_pool(max_workers):
+    """ProcessPoolExecutor with spawned workers"""
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context("spawn"))